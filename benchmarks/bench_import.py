@@ -0,0 +1,99 @@
+import json
+import subprocess
+import sys
+
+import click
+
+# name: python code run in a fresh interpreter
+COMMANDS = {
+    'import_app': 'import s3_static_sync.app',
+    'help': 'import sys; sys.argv = ["s3_static_sync", "--help"]; '
+        'import s3_static_sync.app as app; app.runner()',
+}
+
+# Modules the CLI must not import before it needs them
+LAZY_MODULES = ['asyncio', 'boto3', 'botocore', 'sqlite3', 'multiprocessing']
+
+
+def time_command(code, repeat):
+    # Best wall time of a fresh interpreter, in seconds. The interpreter
+    # reports its own time so process creation noise is left out.
+    timer = ('import time; _start = time.perf_counter()\n'
+        'try:\n'
+        f'    exec({code!r})\n'
+        'except SystemExit:\n'
+        '    pass\n'
+        'import sys; sys.stderr.write(str(time.perf_counter() - _start))')
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', timer],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+        seconds = float(result.stderr.decode().strip().splitlines()[-1])
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def eager_modules():
+    code = ('import sys, s3_static_sync.app\n'
+        f'print(" ".join(name for name in {LAZY_MODULES!r} '
+        'if name in sys.modules))')
+    result = subprocess.run([sys.executable, '-c', code],
+        stdout=subprocess.PIPE, check=True)
+    return result.stdout.decode().split()
+
+
+def find_regressions(results, baseline, tolerance):
+    previous = {item['command']: item for item in baseline}
+    regressions = []
+    for item in results:
+        old = previous.get(item['command'])
+        if old is None:
+            continue
+        if item['seconds'] > old['seconds'] * (1 + tolerance):
+            regressions.append((item, old))
+    return regressions
+
+
+@click.command()
+@click.option('--repeat', default=10, show_default=True,
+    help='Runs per command, the best time is kept')
+@click.option('--output', default=None,
+    help='Write the results as JSON to this file')
+@click.option('--compare', default=None,
+    help='JSON results of a previous run, fail when a command gets slower '
+    'than the tolerance')
+@click.option('--tolerance', default=0.2, show_default=True,
+    help='Allowed slowdown when comparing, as a fraction')
+def main(repeat, output, compare, tolerance):
+    results = []
+    for name, code in COMMANDS.items():
+        item = dict(command=name, seconds=round(time_command(code, repeat), 4))
+        results.append(item)
+        click.echo(f'{name:<12} {item["seconds"] * 1000:>9.1f} ms')
+
+    failed = False
+    eager = eager_modules()
+    if eager:
+        click.echo(f'=> imported at startup: {" ".join(eager)}')
+        failed = True
+
+    if output is not None:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(results, indent=2))
+
+    if compare is not None:
+        with open(compare, 'r', encoding='utf-8') as f:
+            regressions = find_regressions(results, json.loads(f.read()),
+                tolerance)
+        for item, old in regressions:
+            click.echo(f'=> regression {item["command"]}: '
+                f'{item["seconds"] * 1000:.1f} ms, was '
+                f'{old["seconds"] * 1000:.1f} ms')
+        failed = failed or bool(regressions)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
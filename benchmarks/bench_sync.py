@@ -0,0 +1,225 @@
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+
+from s3_static_sync import index, rules, s3, static
+
+BUCKET = 'bench-bucket'
+REGION = 'us-east-1'
+
+# name: (file count, file size, folder depth)
+SHAPES = {
+    'tiny': (5000, 1024, 1),
+    'huge': (4, 32 * 1024 * 1024, 1),
+    'deep': (2000, 4096, 20),
+}
+
+GENERATE_CHUNK_SIZE = 1024 * 1024
+
+BENCHMARKS = ['scan_folder', 'compose_file_name', 'list_folder_s3',
+    'listing_index', 'upload', 'runner']
+# Benchmarks that need the moto S3, the others never import boto3 or moto
+S3_BENCHMARKS = {'list_folder_s3', 'listing_index', 'upload', 'runner'}
+# Metric: True when higher is better
+COMPARED_METRICS = {'files_per_second': True, 'peak_rss_mb': False}
+
+# moto 4 does not decode the aws-chunked bodies recent botocore sends
+os.environ.setdefault('AWS_REQUEST_CHECKSUM_CALCULATION', 'when_required')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+
+
+def generate_tree(root, file_count, file_size, depth):
+    for i in range(file_count):
+        folder = os.path.join(root, *[f'd{(i + level) % 7}'
+            for level in range(depth - 1)])
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f'file-{i}.js'), 'wb') as f:
+            # Written in chunks, a huge file must not weigh on the peak RSS
+            for offset in range(0, file_size, GENERATE_CHUNK_SIZE):
+                size = min(GENERATE_CHUNK_SIZE, file_size - offset)
+                f.write(os.urandom(-(-size // 2)).hex().encode()[:size])
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 if sys.platform != 'darwin' else peak / 1024 / 1024
+
+
+def _compose_all(root):
+    composer = static.KeyComposer(root, 'bench', use_content=True,
+        use_size=False, use_timestamp=False)
+    options = rules.FileOptions('private', None, None, False)
+    for entry in static.scan_entries(root):
+        composer.compose(entry.path, static.get_fingerprint(entry.path,
+            True, False, False), options)
+
+
+def _list_all(client):
+    for _ in s3.list_folder_s3(client, BUCKET, 'bench'):
+        pass
+
+
+def _listing_index(client, concurrency):
+    listing = index.ListingIndex(client, BUCKET, 'bench', workers=concurrency)
+    listing.wait()
+    listing.close()
+
+
+def _upload_all(client, root):
+    for entry in static.scan_entries(root):
+        s3.upload_file(client, entry.path, BUCKET,
+            f'bench/{entry.manifest_path}', 'private')
+
+
+def _runner(root, manifest_file, concurrency):
+    from click.testing import CliRunner
+    from s3_static_sync.app import runner
+    result = CliRunner().invoke(runner, [
+        '--bucket', BUCKET,
+        '--bucket-region', REGION,
+        '--local-folder', root,
+        '--s3-folder', 'bench',
+        '--manifest-file', manifest_file,
+        '--concurrency', str(concurrency),
+        '--no-hash-cache',
+        '--verbose-level', '0',
+    ])
+    if result.exit_code != 0:
+        raise RuntimeError(result.output)
+
+
+def _run(name, root, concurrency):
+    client = None
+    if name in S3_BENCHMARKS:
+        client = s3.get_client(REGION)
+        client.create_bucket(Bucket=BUCKET)
+        if name in ('list_folder_s3', 'listing_index'):
+            _upload_all(client, root)
+
+    start = time.perf_counter()
+    if name == 'scan_folder':
+        for _ in static.scan_folder(root):
+            pass
+    elif name == 'compose_file_name':
+        _compose_all(root)
+    elif name == 'list_folder_s3':
+        _list_all(client)
+    elif name == 'listing_index':
+        _listing_index(client, concurrency)
+    elif name == 'upload':
+        _upload_all(client, root)
+    elif name == 'runner':
+        _runner(root, os.path.join(root, 'manifest.json'), concurrency)
+    return time.perf_counter() - start
+
+
+def run_benchmark(name, shape, concurrency, scale=1.0):
+    # Runs in its own spawned process, which only imports what this
+    # benchmark needs, so the peak RSS belongs to it alone
+    file_count, file_size, depth = SHAPES[shape]
+    file_count = max(1, int(file_count * scale))
+    root = tempfile.mkdtemp(prefix=f'bench-{shape}-')
+    try:
+        generate_tree(root, file_count, file_size, depth)
+        if name in S3_BENCHMARKS:
+            from moto import mock_s3
+            with mock_s3():
+                elapsed = _run(name, root, concurrency)
+        else:
+            elapsed = _run(name, root, concurrency)
+    finally:
+        shutil.rmtree(root)
+
+    total_mb = file_count * file_size / 1024 / 1024
+    return dict(
+        benchmark=name,
+        shape=shape,
+        seconds=round(elapsed, 4),
+        files_per_second=round(file_count / elapsed, 1),
+        mb_per_second=round(total_mb / elapsed, 2),
+        peak_rss_mb=round(peak_rss_mb(), 1))
+
+
+def find_regressions(results, baseline, tolerance):
+    # (result, baseline result, metric) of every metric that got worse by
+    # more than the tolerance
+    previous = {(item['benchmark'], item['shape']): item for item in baseline}
+    regressions = []
+    for item in results:
+        old = previous.get((item['benchmark'], item['shape']))
+        if old is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if metric not in old:
+                continue
+            if higher_is_better:
+                worse = item[metric] < old[metric] * (1 - tolerance)
+            else:
+                worse = item[metric] > old[metric] * (1 + tolerance)
+            if worse:
+                regressions.append((item, old, metric))
+    return regressions
+
+
+@click.command()
+@click.option('--benchmark', '-b', type=click.Choice(BENCHMARKS),
+    multiple=True,
+    help='Benchmark to run. Can be used multiple times, defaults to all')
+@click.option('--shape', '-s', type=click.Choice(list(SHAPES)),
+    multiple=True,
+    help='Tree shape to generate. Can be used multiple times, defaults to all')
+@click.option('--concurrency', '-c', default=8, show_default=True,
+    help='Concurrency used by the runner benchmark')
+@click.option('--scale', default=1.0, show_default=True,
+    help='Multiply the number of generated files, use a small value for a '
+    'quick run')
+@click.option('--output', default=None,
+    help='Write the results as JSON to this file')
+@click.option('--compare', default=None,
+    help='JSON results of a previous run, fail when files/s drop or peak RSS '
+    'grows more than the tolerance')
+@click.option('--tolerance', default=0.2, show_default=True,
+    help='Allowed throughput drop and peak RSS growth when comparing, as a '
+    'fraction')
+def main(benchmark, shape, concurrency, scale, output, compare, tolerance):
+    results = []
+    for shape_name in shape or SHAPES:
+        for name in benchmark or BENCHMARKS:
+            # A forked child would inherit the memory of this process
+            with ProcessPoolExecutor(max_workers=1,
+                    mp_context=multiprocessing.get_context('spawn')) \
+                    as executor:
+                item = executor.submit(run_benchmark, name, shape_name,
+                    concurrency, scale).result()
+            results.append(item)
+            click.echo(f'{item["benchmark"]:<18} {item["shape"]:<5} '
+                f'{item["seconds"]:>9.3f}s {item["files_per_second"]:>10} files/s '
+                f'{item["mb_per_second"]:>9} MB/s {item["peak_rss_mb"]:>8} MB RSS')
+
+    if output is not None:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(results, indent=2))
+
+    if compare is not None:
+        with open(compare, 'r', encoding='utf-8') as f:
+            regressions = find_regressions(results, json.loads(f.read()),
+                tolerance)
+        for item, old, metric in regressions:
+            click.echo(f'=> regression {item["benchmark"]} {item["shape"]}: '
+                f'{metric} {item[metric]}, was {old[metric]}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
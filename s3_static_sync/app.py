@@ -1,8 +1,19 @@
+from . import cache
+from . import compress
+from . import index
+from . import journal as journal_utils
+from . import manifest as manifest_utils
+from . import metrics as metrics_utils
+from . import prune as prune_utils
+from . import rules as rules_utils
 from . import static
 from . import s3
+from . import sync
+from . import throttle
+from . import watch as watch_utils
 from .log import log
 import click
-import json
+import functools
 import os
 
 SYNC_TAG = [
@@ -21,38 +32,196 @@ ACL_CHOICE = [
     'bucket-owner-full-control'
 ]
 
+def _broadcast(option, values, count):
+    # A single value applies to every target
+    if len(values) == count:
+        return list(values)
+    if len(values) == 1:
+        return list(values) * count
+    raise click.UsageError(f'{option} must be given once or once per target')
+
+
+def _target_manifest_file(manifest_file, bucket, s3_folder):
+    root, ext = os.path.splitext(manifest_file)
+    folder = s3_folder.strip('/').replace('/', '_')
+    return '.'.join(part for part in (root, bucket, folder) if part) + ext
+
+
+def _prune_target(target, keep_manifests, min_age, dry_run, fail_on_error,
+        metrics, verbose_level):
+    if target.summary['error']:
+        # Keys of the files that failed are missing from the manifest
+        log(f'=> upload errors, not pruning {target.label}', verbose_level, 1)
+        return
+
+    manifests = [target.manifest]
+    if target.previous_manifest is not None:
+        manifests.append(target.previous_manifest)
+    for history_file in prune_utils.manifest_history(target.manifest_file,
+            keep_manifests):
+        if os.path.exists(history_file):
+            manifests.append(manifest_utils.load_manifest(history_file))
+
+    with metrics.phase('prune'):
+        stale_keys, deleted, errors = prune_utils.prune(target.client,
+            target.bucket, target.s3_folder, manifests, min_age=min_age,
+            dry_run=dry_run)
+    metrics.increment('pruned', deleted)
+
+    for s3_key in stale_keys:
+        log(f'=> stale object {s3_key}', verbose_level, 2)
+    for s3_key, error in errors:
+        if fail_on_error:
+            raise Exception(f'{s3_key}: {error}')
+        log(f'=> error pruning {s3_key}: {error}', verbose_level, 2)
+    log(f'=> pruned {deleted} of {len(stale_keys)} stale objects from '
+        f'{target.label}', verbose_level, 1)
+
+
+def _watch(ctx, targets, listings, watcher, sync_entries, hash_cache,
+        manifest_format, debounce, verbose_level):
+    # The remote indexes, the hash cache and the manifests stay in memory,
+    # every batch only costs the requests of the files that changed. The
+    # watcher was created before the initial sync, its first batch holds
+    # the files changed while it ran.
+    log(f'=> watching {watcher.folder} for changes', verbose_level, 1)
+    try:
+        for batch in watch_utils.batches(watcher, debounce=debounce):
+            for target in targets:
+                watch_utils.drop_deleted(target.manifest, batch.deleted)
+            sync_entries(batch.entries)
+            for target in targets:
+                manifest_utils.write_manifest(target.manifest_file,
+                    target.manifest, manifest_format or
+                    manifest_utils.infer_format(target.manifest_file))
+            if hash_cache is not None:
+                hash_cache.save()
+            log(f'=> synced {len(batch.entries)} changed and '
+                f'{len(batch.deleted)} removed paths', verbose_level, 1)
+    except KeyboardInterrupt:
+        log('=> stopped watching', verbose_level, 1)
+    finally:
+        watcher.close()
+        ctx.close()
+        for listing in listings:
+            listing.close()
+
+
 @click.command()
 @click.option('--local-folder', '-fl', required=True,
     help='Local folder to sync')
-@click.option('--s3-folder', '-fs3', required=True,
-    help='S3 folder to upload synced files')
-@click.option('--allow-extension', '-ea', default=None,
-    help='Allow only files with this extension. Example: .js')
-@click.option('--ignore-extension', '-ei', default=None,
-    help='Ignore files with this extension. Example: .ignore')
+@click.option('--s3-folder', '-fs3', required=True, multiple=True,
+    help='S3 folder to upload synced files. Can be used multiple times, '
+    'once per --bucket')
+@click.option('--allow-extension', '-ea', multiple=True,
+    help='Allow only files with this extension. Can be used multiple times. '
+    'Example: .js')
+@click.option('--ignore-extension', '-ei', multiple=True,
+    help='Ignore files with this extension. Can be used multiple times. '
+    'Example: .ignore')
+@click.option('--include', multiple=True,
+    help='Only sync files matching this glob, or this regex with a re: '
+    'prefix. Can be used multiple times. Example: "assets/**/*.js"')
+@click.option('--exclude', multiple=True,
+    help='Skip files matching this glob, or this regex with a re: prefix. '
+    'Can be used multiple times. Example: "*.map"')
+@click.option('--rules-file', default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help='JSON list of rules with a pattern and include, exclude or acl, '
+    'cache_control, expires_delta and gzip overrides')
 @click.option('--acl', type=click.Choice(ACL_CHOICE, case_sensitive=True),
     default=ACL_CHOICE[0],
     show_default=True,
     help='S3 ACL to apply to uploaded files')
-@click.option('--bucket', required=True,
-    help='S3 bucket to upload files')
-@click.option('--bucket-region', required=True,
-    help='S3 bucket region')
+@click.option('--bucket', required=True, multiple=True,
+    help='S3 bucket to upload files. Can be used multiple times to publish '
+    'to several targets')
+@click.option('--bucket-region', required=True, multiple=True,
+    help='S3 bucket region. Can be used multiple times, once per --bucket')
 @click.option('--sync-strategy', '-ss',
     type=click.Choice(SYNC_TAG, case_sensitive=True),
     default=[SYNC_TAG[0]],
     show_default=True,
     multiple=True,
     help='Sync strategy to compose file name. Can be used multiple times')
-@click.option('--manifest-file', default='manifest.json',
-    help='Path of the manifest file that will be created',
+@click.option('--manifest-file', default=['manifest.json'], multiple=True,
+    help='Path of the manifest file that will be created. With several '
+    'targets, give one per target or a single path that is suffixed with '
+    'the bucket and folder',
     show_default=True)
+@click.option('--manifest-format', type=click.Choice(manifest_utils.FORMATS),
+    default=None,
+    help='Manifest format. json: indented JSON, min: minified JSON, jsonl: '
+    'one ["path", "key"] array per line, gzip: gzipped minified JSON. '
+    'Defaults to jsonl for .jsonl files, gzip for .gz files and json '
+    'otherwise')
+@click.option('--previous-manifest', multiple=True,
+    help='Manifest of the previous deploy. Files whose composed key matches '
+    'it are trusted without checking S3, and the remote listing is skipped. '
+    'With several targets, give one per target')
+@click.option('--no-journal', is_flag=True,
+    help='Do not keep the journal of completed files that lets an '
+    'interrupted run resume where it stopped')
+@click.option('--journal-fsync-every', default=100,
+    type=click.IntRange(min=1),
+    show_default=True,
+    help='Flush the journal to disk every this many files')
+@click.option('--verify-sample', default=0, type=click.IntRange(min=0),
+    show_default=True,
+    help='Check this many random keys of the previous manifest on S3 before '
+    'trusting it')
+@click.option('--keep-manifests', default=0, type=click.IntRange(min=0),
+    show_default=True,
+    help='Keep this many previous manifests next to the manifest file, as '
+    'manifest.json.1, manifest.json.2, ...')
+@click.option('--prune', is_flag=True,
+    help='Delete objects of the S3 folder that are not referenced by the new '
+    'manifest, the kept manifests or the previous manifest')
+@click.option('--prune-min-age', default=24 * 3600,
+    type=click.IntRange(min=0),
+    show_default=True,
+    help='Never prune objects modified less than this many seconds ago')
+@click.option('--hash-cache-file', default=None,
+    help='Path of the local hash cache. Defaults to the manifest path '
+    'with a .hashcache suffix')
+@click.option('--no-hash-cache', is_flag=True,
+    help='Hash every file instead of reusing digests of unchanged files')
 @click.option('--header-cache-control', default=None,
     help='Header Cache-Control to apply to uploaded files. Ex: max-age=3600')
 @click.option('--header-expires-delta', default=None, type=int,
     help='Time in seconds used in the header Expires, this will be applied to the uploaded files. Ex: 3600')
 @click.option('--gzip', is_flag=True,
     help='Gzip content before upload')
+@click.option('--gzip-level', default=9, type=click.IntRange(1, 9),
+    show_default=True,
+    help='Gzip compression level')
+@click.option('--gzip-min-savings', default=0.0,
+    type=click.FloatRange(0, 1),
+    show_default=True,
+    help='Upload files uncompressed when compression saves less than this '
+    'fraction of their size. Ex: 0.1')
+@click.option('--compress-workers', default=0, type=click.IntRange(min=0),
+    show_default=True,
+    help='Number of processes used to compress files. 0 compresses in the '
+    'upload threads')
+@click.option('--brotli', is_flag=True,
+    help='Also upload a brotli compressed variant of each file with a .br '
+    'suffix. Requires the brotli package')
+@click.option('--multipart-threshold', default=64 * 1024 * 1024,
+    type=click.IntRange(min=5 * 1024 * 1024),
+    show_default=True,
+    help='Files of this size in bytes or larger are streamed in a parallel multipart upload')
+@click.option('--multipart-chunksize', default=8 * 1024 * 1024,
+    type=click.IntRange(min=5 * 1024 * 1024),
+    show_default=True,
+    help='Size in bytes of each part of a multipart upload')
+@click.option('--dedup', is_flag=True,
+    help='Upload files with identical content once per bucket and copy the '
+    'duplicates server side. Requires the content sync strategy')
+@click.option('--verify-objects', is_flag=True,
+    help='Compare the ETag and size of listed objects with the local files '
+    'and upload again the objects that do not match. Uses the listing '
+    'only, no extra request is sent')
 @click.option('--fail-on-error', is_flag=True,
     help='Fail on error')
 @click.option('--dry-run', is_flag=True,
@@ -62,81 +231,369 @@ ACL_CHOICE = [
     'If not present, the script will do one request to obtain the files contained in a folder '
     'and keep the list in memory. Enable this flag only if you have many files and '
     'you need a low memory footprint.')
+@click.option('--endpoint-url', default=None,
+    help='S3 endpoint URL, for S3 compatible services or local stand-ins. '
+    'Ex: http://localhost:9000')
+@click.option('--max-pool-connections', default=None,
+    type=click.IntRange(min=1),
+    help='Size of the HTTP connection pool. Defaults to 4 per concurrent '
+    'file, at least 10')
+@click.option('--connect-timeout', default=None, type=click.FloatRange(min=0),
+    help='Seconds to wait for a connection to S3')
+@click.option('--read-timeout', default=None, type=click.FloatRange(min=0),
+    help='Seconds to wait for S3 to answer on an open connection')
+@click.option('--tcp-keepalive/--no-tcp-keepalive', default=True,
+    show_default=True,
+    help='Enable TCP keepalive on S3 connections')
+@click.option('--max-retries', default=4, type=click.IntRange(min=0),
+    show_default=True,
+    help='Retries of a throttled or failed S3 request, with jittered '
+    'exponential backoff')
+@click.option('--lookup-mode', type=click.Choice(['list', 'head', 'prefix']),
+    default=None,
+    help='How existing files are detected. list: list the whole S3 folder '
+    'once (default). head: one request per file (same as --low-memory-mode). '
+    'prefix: list only the folders present locally, a few at a time')
+@click.option('--list-workers', default=8, type=click.IntRange(min=1),
+    show_default=True,
+    help='Number of remote folders and key ranges listed in parallel. Files '
+    'are synced as soon as their folder is listed')
+@click.option('--concurrency', '-c', default=1, type=click.IntRange(min=1),
+    show_default=True,
+    help='Number of files hashed, checked and uploaded in parallel')
+@click.option('--schedule', type=click.Choice(sync.SCHEDULES),
+    default='scan',
+    show_default=True,
+    help='Upload order. scan: files are synced as they are scanned. '
+    'largest-first: the scan is collected and the largest files are '
+    'uploaded first, which keeps the end of the run short')
+@click.option('--upload-last', multiple=True,
+    help='Upload files matching this glob, or this regex with a re: prefix, '
+    'once every other file is uploaded. Can be used multiple times. '
+    'Example: "*.html"')
+@click.option('--engine', type=click.Choice(['thread', 'async']),
+    default='thread',
+    show_default=True,
+    help='Sync engine. async runs scan, hashing, existence checks and '
+    'uploads as a pipeline of bounded queues')
+@click.option('--metrics-file', default=None,
+    help='Write a JSON report with time per phase, S3 request latencies, '
+    'bytes sent and retries to this file')
+@click.option('--metrics-prometheus', default=None,
+    help='Write the same metrics in the Prometheus textfile format to this '
+    'file')
+@click.option('--watch', is_flag=True,
+    help='After the sync, keep watching the local folder and sync the '
+    'files that change, rewriting the manifest after each batch')
+@click.option('--watch-debounce', default=0.5, type=click.FloatRange(min=0),
+    show_default=True,
+    help='Seconds without changes before a batch of changes is synced')
+@click.option('--watch-interval', default=1.0,
+    type=click.FloatRange(min=0.01),
+    show_default=True,
+    help='Seconds between scans when inotify is not available')
 @click.option('--verbose-level', '-v',
     type=click.Choice(['0', '1', '2']),
     default='2',
     help='Verbose level. 0: no output, 1: only resume, 2: full verbose')
 def runner(bucket, bucket_region, local_folder, s3_folder, allow_extension,
-        ignore_extension, acl, manifest_file, sync_strategy,
-        header_cache_control, header_expires_delta, gzip, fail_on_error,
-        dry_run, low_memory_mode, verbose_level):
-
-    s3_client = s3.get_client(bucket_region)
-    s3_folder = s3.normalize_folder_name(s3_folder)
-    s3_folder_file_list = None
-    manifest = {}
-    summary = dict(total=0, skipped=0, uploaded=0, error=0)
-
-    if not low_memory_mode:
-        log(f'=> listing files from remote s3 bucket s3://{bucket}',
-            verbose_level, 2)
-        s3_folder_file_list = list(
-            s3.list_folder_s3(s3_client, bucket, s3_folder))
-
-    for file_path, manifest_path in static.scan_folder(local_folder,
-            allow_extension, ignore_extension):
+        ignore_extension, include, exclude, rules_file, acl, manifest_file,
+        manifest_format, sync_strategy, previous_manifest, no_journal,
+        journal_fsync_every, verify_sample, keep_manifests, prune,
+        prune_min_age, hash_cache_file, no_hash_cache, header_cache_control,
+        header_expires_delta, gzip,
+        gzip_level, gzip_min_savings, compress_workers, brotli,
+        multipart_threshold, multipart_chunksize, dedup, verify_objects,
+        fail_on_error, dry_run, low_memory_mode, endpoint_url,
+        max_pool_connections, connect_timeout, read_timeout, tcp_keepalive,
+        max_retries, lookup_mode, list_workers, concurrency, schedule,
+        upload_last, engine, metrics_file, metrics_prometheus, watch,
+        watch_debounce, watch_interval, verbose_level):
+
+    target_count = max(len(bucket), len(bucket_region), len(s3_folder))
+    buckets = _broadcast('--bucket', bucket, target_count)
+    regions = _broadcast('--bucket-region', bucket_region, target_count)
+    s3_folders = [s3.normalize_folder_name(folder)
+        for folder in _broadcast('--s3-folder', s3_folder, target_count)]
+    if len(manifest_file) == 1 and target_count > 1:
+        manifest_files = [_target_manifest_file(manifest_file[0], name, folder)
+            for name, folder in zip(buckets, s3_folders)]
+    else:
+        manifest_files = _broadcast('--manifest-file', manifest_file,
+            target_count)
+    # A previous manifest only vouches for the target it was written for
+    if previous_manifest and len(previous_manifest) != target_count:
+        raise click.UsageError('--previous-manifest must be given once per '
+            'target')
+    previous_manifests = list(previous_manifest) or [None] * target_count
+
+    try:
+        rules = rules_utils.Rules(include=include, exclude=exclude,
+            rules=rules_utils.load_rules(rules_file) if rules_file else (),
+            allow_extension=allow_extension,
+            ignore_extension=ignore_extension,
+            defaults=rules_utils.FileOptions(acl, header_cache_control,
+                header_expires_delta, gzip),
+            upload_last=upload_last)
+    except ValueError as ex:
+        raise click.UsageError(str(ex))
+
+    if dedup and 'content' not in sync_strategy:
+        raise click.UsageError('--dedup requires the content sync strategy')
+
+    if lookup_mode is None:
+        lookup_mode = 'head' if low_memory_mode else 'list'
+    if verify_objects and lookup_mode == 'head':
+        raise click.UsageError('--verify-objects needs the listing, it '
+            'cannot be used with head lookups')
+    if verify_objects and previous_manifest:
+        # The previous manifest vouches for its keys, they are never listed
+        raise click.UsageError('--verify-objects cannot be used with '
+            '--previous-manifest, whose keys are trusted without checking')
+
+    # Options are all checked before any listing starts
+    try:
+        compressor = compress.Compressor(level=gzip_level,
+            min_savings=gzip_min_savings, workers=compress_workers,
+            brotli=brotli)
+    except ImportError:
+        raise click.UsageError('--brotli requires the brotli package')
+
+    metrics = metrics_utils.Metrics()
+    max_connections = max_pool_connections or s3.auto_pool_size(concurrency)
+    clients = {}
+    targets = []
+    listings = []
+    hash_cache = None
+
+    # Listings start at once, an error or an interrupt while the other
+    # targets are set up must not leave them running
+    try:
+        for name, region, folder, target_manifest_file, previous in zip(
+                buckets, regions, s3_folders, manifest_files,
+                previous_manifests):
+            if region not in clients:
+                # Retries are handled by the throttle layer, which also lowers
+                # the request concurrency when S3 answers with SlowDown. The
+                # client is only created by the first request.
+                clients[region] = throttle.ThrottledClient(
+                    s3.LazyClient(functools.partial(s3.get_client, region,
+                        max_pool_connections=max_connections,
+                        max_attempts=1,
+                        connect_timeout=connect_timeout,
+                        read_timeout=read_timeout,
+                        tcp_keepalive=tcp_keepalive,
+                        endpoint_url=endpoint_url,
+                        cached=True), on_create=metrics.instrument_client),
+                    throttle.AdaptiveLimiter(max_connections),
+                    throttle.RetryPolicy(max_attempts=max_retries + 1),
+                    metrics=metrics)
+            s3_client = clients[region]
+
+            trusted_manifest = None
+            remote_index = None
+            if previous is not None:
+                if os.path.exists(previous):
+                    trusted_manifest = manifest_utils.load_manifest(previous)
+                else:
+                    log(f'=> previous manifest {previous} not found, '
+                        'running a full sync', verbose_level, 2)
+
+            if trusted_manifest and verify_sample:
+                missing = manifest_utils.sample_missing_keys(s3_client, name,
+                    trusted_manifest, verify_sample)
+                if missing:
+                    log(f'=> {len(missing)} sampled keys of the previous '
+                        'manifest are missing on S3, running a full sync',
+                        verbose_level, 2)
+                    trusted_manifest = None
+
+            if lookup_mode == 'prefix':
+                remote_index = index.PrefixIndex(s3_client, name,
+                    max_folders=max(concurrency * 2, 16))
+            elif lookup_mode == 'list' and trusted_manifest is None:
+                log(f'=> listing files from remote s3 bucket s3://{name}',
+                    verbose_level, 2)
+                remote_index = index.ListingIndex(s3_client, name, folder,
+                    workers=list_workers, metrics=metrics)
+                listings.append(remote_index)
+
+            completed = None
+            if not no_journal:
+                journal_file = journal_utils.journal_path(target_manifest_file)
+                completed = journal_utils.load_journal(journal_file, name)
+                if completed:
+                    log(f'=> resuming an interrupted run, {len(completed)} '
+                        f'files completed in {journal_file}', verbose_level,
+                        2)
+
+            targets.append(sync.Target(s3_client, name, folder,
+                remote_index=remote_index,
+                previous_manifest=trusted_manifest,
+                manifest_file=target_manifest_file,
+                completed=completed or None,
+                keep_manifest=prune or watch))
+
+        if not no_hash_cache and 'content' in sync_strategy:
+            hash_cache = cache.HashCache(
+                hash_cache_file or f'{manifest_file[0]}.hashcache')
+    except BaseException:
+        compressor.close()
+        for listing in listings:
+            listing.close()
+        raise
+
+    ctx = sync.SyncContext(local_folder, acl, sync_strategy, targets,
+        header_cache_control=header_cache_control,
+        header_expires_delta=header_expires_delta,
+        gzip=gzip,
+        dry_run=dry_run,
+        hash_cache=hash_cache,
+        multipart_threshold=multipart_threshold,
+        multipart_chunksize=multipart_chunksize,
+        compressor=compressor,
+        metrics=metrics,
+        fanout_workers=concurrency * target_count,
+        rules=rules,
+        dedup=dedup,
+        verify=verify_objects)
+
+    entries = metrics.timed_iter(static.scan_entries(local_folder,
+        workers=concurrency, rules=rules), 'scan')
+
+    def handle_result(result):
+        target = result.target
+        summary = target.summary
         summary['total'] += 1
+        manifest_path, s3_key = result.manifest_path, result.s3_key
+        label = f' to {target.label}' if target_count > 1 else ''
 
-        s3_key = static.compose_file_name(
-            local_folder,
-            s3_folder,
-            file_path,
-            header_cache_control=header_cache_control,
-            header_expires_delta=header_expires_delta,
-            use_gzip=gzip,
-            use_content='content' in sync_strategy,
-            use_size='size' in sync_strategy,
-            use_timestamp='timestamp' in sync_strategy)
-
-        if (s3_folder_file_list is not None and s3_key in s3_folder_file_list) or \
-                (s3_folder_file_list is None and s3.check_key_exists(s3_client, bucket, s3_key)):
-            manifest[manifest_path] = s3_key
-            log(f'=> file exist, skip {manifest_path}', verbose_level, 2)
+        if result.status == sync.SKIPPED:
+            target.add_to_manifest(manifest_path, s3_key)
+            log(f'=> file exist, skip {manifest_path}{label}',
+                verbose_level, 2)
             summary['skipped'] += 1
-            continue
-
-        if not dry_run:
-            success, err = s3.upload_file(s3_client, file_path, bucket,
-                s3_key, acl,
-                header_cache_control=header_cache_control,
-                header_expires_delta=header_expires_delta,
-                gzip=gzip)
-        else:
-            success, err = True, None
-
-        if not success:
+        elif result.status == sync.ERROR:
             if fail_on_error:
-                raise Exception(err)
-            log(f'=> error uploading file, not adding to manifest '
-                'file: {err}', verbose_level, 2)
+                raise Exception(result.error)
+            log(f'=> error uploading file{label}, not adding to manifest '
+                f'file: {result.error}', verbose_level, 2)
             summary['error'] += 1
+        elif result.status == sync.COPIED:
+            log(f'=> file copied {manifest_path}{label} from a duplicate',
+                verbose_level, 2)
+            target.add_to_manifest(manifest_path, s3_key)
+            target.add_key(s3_key)
+            summary['copied'] += 1
         else:
-            click.echo(f'=> file uploaded {manifest_path}')
-            manifest[manifest_path] = s3_key
+            click.echo(f'=> file uploaded {manifest_path}{label}')
+            target.add_to_manifest(manifest_path, s3_key)
+            target.add_key(s3_key)
             summary['uploaded'] += 1
 
-    log(f'=> writing manifest at {manifest_file}', verbose_level, 2)
-    with open(manifest_file, 'w', encoding='utf-8') as f:
-        f.write(json.dumps(manifest, indent=2))
-
-    summary_text = (
-        f'\n=> Resume\n'
-        f'==> Total   : {summary["total"]}\n'
-        f'==> Uploaded: {summary["uploaded"]}\n'
-        f'==> Skipped : {summary["skipped"]}\n'
-        f'==> Error   : {summary["error"]}'
-    )
-    log(summary_text, verbose_level, 1)
+    def sync_entries(entries):
+        # Interleaving folders would evict the folders listed for prefix
+        # lookups and list them again
+        for group in sync.schedule(ctx, entries, schedule,
+                by_folder=lookup_mode == 'prefix'):
+            if engine == 'async':
+                # asyncio is only imported by the engine that uses it
+                from . import pipeline
+                pipeline.run(ctx, group, concurrency, handle_result)
+            else:
+                for result in sync.sync_files(ctx, group, concurrency,
+                        ordered=schedule == 'scan'):
+                    handle_result(result)
+
+    watcher = None
+    try:
+        # Manifests are streamed while files are synced and only replace the
+        # previous ones once the run is complete
+        for target in targets:
+            log(f'=> writing manifest at {target.manifest_file}',
+                verbose_level, 2)
+            target.manifest_writer = manifest_utils.ManifestWriter(
+                target.manifest_file, manifest_format or
+                manifest_utils.infer_format(target.manifest_file))
+            if not no_journal and not dry_run:
+                target.journal = journal_utils.Journal(
+                    journal_utils.journal_path(target.manifest_file),
+                    target.bucket, fsync_every=journal_fsync_every)
+
+        # Watches from before the scan, so a file the build rewrites during
+        # the initial sync is in the first batch
+        if watch:
+            watcher = watch_utils.get_watcher(local_folder, rules,
+                interval=watch_interval)
+
+        sync_entries(entries)
+    except BaseException:
+        if watcher is not None:
+            watcher.close()
+        ctx.close()
+        for listing in listings:
+            listing.close()
+        for target in targets:
+            if target.manifest_writer is not None:
+                target.manifest_writer.abort()
+            # The next run resumes from the journal
+            if target.journal is not None:
+                target.journal.close()
+        raise
+    if not watch:
+        ctx.close()
+        for listing in listings:
+            listing.close()
+
+    for target in targets:
+        prune_utils.rotate_manifests(target.manifest_file, keep_manifests)
+        target.manifest_writer.close()
+        target.manifest_writer = None
+        if target.journal is not None:
+            target.journal.remove()
+            target.journal = None
+
+    if prune:
+        for target in targets:
+            _prune_target(target, keep_manifests, prune_min_age, dry_run,
+                fail_on_error, metrics, verbose_level)
+
+    if hash_cache is not None:
+        hash_cache.save()
+
+    for s3_client in clients.values():
+        if s3_client.created:
+            metrics.release_client(s3_client)
+    total_summary = dict(total=0, skipped=0, uploaded=0, copied=0, error=0)
+    for target in targets:
+        for key, value in target.summary.items():
+            total_summary[key] += value
+    metrics_utils.write_report(metrics, total_summary, metrics_file,
+        metrics_prometheus)
+
+    for target in targets:
+        summary = target.summary
+        title = f' {target.label}' if target_count > 1 else ''
+        summary_text = (
+            f'\n=> Resume{title}\n'
+            f'==> Total   : {summary["total"]}\n'
+            f'==> Uploaded: {summary["uploaded"]}\n'
+            + (f'==> Copied  : {summary["copied"]}\n' if dedup else '') +
+            f'==> Skipped : {summary["skipped"]}\n'
+            f'==> Error   : {summary["error"]}'
+        )
+        log(summary_text, verbose_level, 1)
+    if dedup:
+        log(f'=> deduplication saved '
+            f'{metrics.counters["bytes_deduplicated"]} bytes',
+            verbose_level, 1)
+    if verify_objects:
+        log(f'=> {metrics.counters["verify_mismatches"]} objects did not '
+            'match the local files and were uploaded again', verbose_level, 1)
+
+    if watch:
+        _watch(ctx, targets, listings, watcher, sync_entries, hash_cache,
+            manifest_format, watch_debounce, verbose_level)
 
 
 if __name__ == '__main__':
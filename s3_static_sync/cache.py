@@ -0,0 +1,92 @@
+import os
+import time
+
+from . import static
+
+SCHEMA_VERSION = 1
+
+# Files modified this close to the moment they are hashed may change again
+# within the mtime granularity of the filesystem, those are never cached.
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+
+def _stat_key(stat_result):
+    # SQLite integers are signed 64 bits, fold large inode numbers into range.
+    return (stat_result.st_size, stat_result.st_mtime_ns,
+        stat_result.st_ino & 0x7FFFFFFFFFFFFFFF)
+
+
+class HashCache:
+    # Maps a relative path to the content MD5 computed in a previous run. An
+    # entry is only trusted while the size, mtime_ns and inode of the file
+    # still match, and entries for files not seen in this run are dropped on
+    # save.
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._seen = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        import sqlite3
+        conn = sqlite3.connect(self.path)
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                return
+            for row in conn.execute(
+                    'SELECT path, size, mtime_ns, inode, md5 FROM files'):
+                self._entries[row[0]] = row[1:]
+        except sqlite3.DatabaseError:
+            # A corrupt or foreign file is treated as an empty cache and
+            # replaced on save.
+            self._entries = {}
+        finally:
+            conn.close()
+
+    def get(self, relative_path, stat_result):
+        entry = self._entries.get(relative_path)
+        if entry is None:
+            return None
+
+        if entry[:3] != _stat_key(stat_result):
+            return None
+
+        self._seen[relative_path] = entry
+        return entry[3]
+
+    def set(self, relative_path, stat_result, md5):
+        if time.time_ns() - stat_result.st_mtime_ns < RACY_WINDOW_NS:
+            return
+        self._seen[relative_path] = _stat_key(stat_result) + (md5, )
+
+    def get_md5(self, relative_path, file_path, stat_result=None):
+        if stat_result is None:
+            stat_result = os.stat(file_path)
+
+        md5 = self.get(relative_path, stat_result)
+        if md5 is None:
+            md5 = static.get_md5_content(file_path)
+            self.set(relative_path, stat_result, md5)
+        return md5
+
+    def save(self):
+        import sqlite3
+        tmp_path = f'{self.path}.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.execute('CREATE TABLE files (path TEXT PRIMARY KEY, '
+                'size INTEGER, mtime_ns INTEGER, inode INTEGER, md5 TEXT)')
+            conn.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?)',
+                ((path, ) + entry for path, entry in self._seen.items()))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, self.path)
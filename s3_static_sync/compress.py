@@ -0,0 +1,75 @@
+from . import s3
+
+# Formats that are already compressed, gzip only burns CPU on them.
+INCOMPRESSIBLE_MIME_TYPES = {
+    'application/gzip',
+    'application/x-7z-compressed',
+    'application/x-bzip2',
+    'application/x-gzip',
+    'application/x-xz',
+    'application/zip',
+    'font/woff',
+    'font/woff2',
+    'image/avif',
+    'image/gif',
+    'image/jpeg',
+    'image/png',
+    'image/webp',
+}
+INCOMPRESSIBLE_MIME_PREFIXES = ('audio/', 'video/')
+# Not every python version knows these types
+INCOMPRESSIBLE_EXTENSIONS = ('.avif', '.br', '.gz', '.webp', '.woff', '.woff2',
+    '.zst')
+
+
+def brotli_content(content, quality=11):
+    import brotli
+    return brotli.compress(content, quality=quality)
+
+
+class Compressor:
+    def __init__(self, level=9, min_savings=0.0, workers=0, brotli=False):
+        self.level = level
+        self.min_savings = min_savings
+        self.brotli = brotli
+        self._executor = None
+        if brotli:
+            # Fail early when the optional brotli package is missing
+            brotli_content(b'')
+        if workers > 0:
+            # multiprocessing is slow to import, only load it when used
+            from concurrent.futures import ProcessPoolExecutor
+            import multiprocessing
+            # Workers start at the first file, once upload threads are
+            # running: forking then could copy a lock held by another thread
+            methods = multiprocessing.get_all_start_methods()
+            self._executor = ProcessPoolExecutor(max_workers=workers,
+                mp_context=multiprocessing.get_context('forkserver'
+                    if 'forkserver' in methods else 'spawn'))
+
+    def is_compressible(self, file_name):
+        if file_name.lower().endswith(INCOMPRESSIBLE_EXTENSIONS):
+            return False
+        mime_type = s3.guess_mime_type(file_name)
+        return mime_type not in INCOMPRESSIBLE_MIME_TYPES and \
+            not mime_type.startswith(INCOMPRESSIBLE_MIME_PREFIXES)
+
+    def _run(self, fn, *args):
+        if self._executor is None:
+            return fn(*args)
+        return self._executor.submit(fn, *args).result()
+
+    def _worth_it(self, content, compressed):
+        return len(compressed) < len(content) * (1 - self.min_savings)
+
+    def gzip(self, content):
+        compressed = self._run(s3.gzip_content, content, self.level)
+        return compressed if self._worth_it(content, compressed) else None
+
+    def brotli_variant(self, content):
+        compressed = self._run(brotli_content, content)
+        return compressed if self._worth_it(content, compressed) else None
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -0,0 +1,43 @@
+import threading
+
+
+class Blob:
+    def __init__(self):
+        self.ready = threading.Event()
+        self.s3_key = None
+        self.content_encoding = None
+        self.has_brotli = False
+        self.size = 0
+
+
+class Deduplicator:
+    # Blobs uploaded during this run, per bucket and content. A file with the
+    # same digest and encoding as a blob already sent to a bucket is copied
+    # from it server side instead of being compressed and sent again.
+    # Objects that already existed before the run are never used as a
+    # source, their encoding and brotli variant are unknown.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blobs = {}
+
+    def claim(self, bucket, blob_key):
+        # Returns (owner, source). The first caller owns the blob and must
+        # call done() once it is uploaded. The others wait for the owner and
+        # get the Blob to copy from, or None when the owner failed.
+        with self._lock:
+            blob = self._blobs.get((bucket, blob_key))
+            if blob is None:
+                self._blobs[(bucket, blob_key)] = Blob()
+                return True, None
+        blob.ready.wait()
+        return False, blob if blob.s3_key is not None else None
+
+    def done(self, bucket, blob_key, s3_key=None, content_encoding=None,
+            has_brotli=False, size=0):
+        # s3_key is None when the upload failed
+        blob = self._blobs[(bucket, blob_key)]
+        blob.s3_key = s3_key
+        blob.content_encoding = content_encoding
+        blob.has_brotli = has_brotli
+        blob.size = size
+        blob.ready.set()
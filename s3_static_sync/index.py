@@ -0,0 +1,403 @@
+from array import array
+import bisect
+from collections import OrderedDict
+import struct
+import threading
+import time
+
+from . import s3
+
+# Split points of a large key range, by the first character of the names
+# that follow its first page
+SPLIT_CHARACTERS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+# Levels of remote subfolders looked at for the first split points
+PROBE_DEPTH = 4
+
+
+# Initial size of the hash table of a RemoteIndex, a power of two
+MIN_SLOTS = 8
+# Part counts of an object without ETag, and of one whose ETag is not an
+# MD5 digest (e.g. SSE-KMS), which is kept as is in a side dict
+_NO_ETAG = 0xFFFFFFFF
+_OTHER_ETAG = 0xFFFFFFFE
+_EMPTY_DIGEST = bytes(16)
+# ETag digest, part count and size of an object
+_RECORD = struct.Struct('<16sIQ')
+_OTHER_ETAG_BYTES = struct.pack('<I', _OTHER_ETAG)
+
+
+def _pack_record(etag, size):
+    # The part count of a plain ETag is 0
+    if not etag:
+        return _RECORD.pack(_EMPTY_DIGEST, _NO_ETAG, size or 0)
+    digest, _, parts = etag.strip('"').partition('-')
+    try:
+        raw_digest = bytes.fromhex(digest)
+        part_count = int(parts) if parts else 0
+    except ValueError:
+        part_count = _OTHER_ETAG
+    else:
+        if len(raw_digest) != 16 or not 0 <= part_count < _OTHER_ETAG:
+            part_count = _OTHER_ETAG
+    if part_count == _OTHER_ETAG:
+        raw_digest = _EMPTY_DIGEST
+    return _RECORD.pack(raw_digest, part_count, size or 0)
+
+
+def _unpack_etag(raw_digest, part_count):
+    if part_count == _NO_ETAG:
+        return None
+    if part_count == 0:
+        return raw_digest.hex()
+    return f'{raw_digest.hex()}-{part_count}'
+
+
+class RemoteIndex:
+    # Open addressing hash table over flat arrays. Keys are stored without
+    # the shared prefix: the UTF-8 suffixes are appended to one bytearray
+    # with an array of offsets, the hashes to another array, and ETag
+    # digest, part count and size as one packed record per key. The table
+    # maps a slot to a position in these arrays. A key costs its suffix, 40
+    # bytes and two or three table slots, less than a list of full key
+    # strings, and a lookup is a hash and a probe or two.
+    # Writers hold the lock, readers do not: the arrays are appended before
+    # a position is published in the table, and a full table is replaced by
+    # a larger one rather than resized in place.
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._prefix_length = len(prefix)
+        self._blob = bytearray()
+        self._offsets = array('Q', [0])
+        # Low 32 bits of the hash of each suffix, enough for any table size
+        self._hashes = array('I')
+        self._records = bytearray()
+        self._other_etags = {}
+        # slot -> position in the arrays, -1 for an empty slot
+        self._table = array('i', [-1]) * MIN_SLOTS
+        self._lock = threading.Lock()
+
+    def _find(self, suffix, suffix_hash, table):
+        # (slot of suffix in table or the empty slot where it goes, position
+        # of suffix or -1)
+        mask = len(table) - 1
+        slot = suffix_hash & mask
+        blob, offsets, hashes = self._blob, self._offsets, self._hashes
+        while True:
+            position = table[slot]
+            if position < 0 or (hashes[position] == suffix_hash and
+                    blob[offsets[position]:offsets[position + 1]] == suffix):
+                return slot, position
+            slot = (slot + 1) & mask
+
+    def _grow(self):
+        # Called with the lock held, once the table is two thirds full
+        table = array('i', [-1]) * (len(self._table) * 2)
+        mask = len(table) - 1
+        for position, suffix_hash in enumerate(self._hashes):
+            slot = suffix_hash & mask
+            while table[slot] >= 0:
+                slot = (slot + 1) & mask
+            table[slot] = position
+        self._table = table
+
+    def add(self, key, etag=None, size=None):
+        if not key.startswith(self.prefix):
+            raise ValueError(f'{key} is outside of prefix {self.prefix}')
+        suffix = key[self._prefix_length:].encode()
+        suffix_hash = hash(suffix) & 0xFFFFFFFF
+        record = _pack_record(etag, size)
+        with self._lock:
+            if etag and record[16:20] == _OTHER_ETAG_BYTES:
+                self._other_etags[suffix] = etag.strip('"')
+            elif self._other_etags:
+                self._other_etags.pop(suffix, None)
+            table = self._table
+            slot, position = self._find(suffix, suffix_hash, table)
+            if position >= 0:
+                start = position * _RECORD.size
+                self._records[start:start + _RECORD.size] = record
+                return
+
+            self._blob += suffix
+            self._offsets.append(len(self._blob))
+            self._hashes.append(suffix_hash)
+            self._records += record
+            table[slot] = len(self._hashes) - 1
+            if len(self._hashes) * 3 >= len(table) * 2:
+                self._grow()
+
+    def _position(self, key):
+        if not key.startswith(self.prefix):
+            return None, -1
+        suffix = key[self._prefix_length:].encode()
+        return suffix, self._find(suffix, hash(suffix) & 0xFFFFFFFF,
+            self._table)[1]
+
+    def get(self, key):
+        suffix, position = self._position(key)
+        if position < 0:
+            return None
+        raw_digest, part_count, size = _RECORD.unpack_from(self._records,
+            position * _RECORD.size)
+        if part_count == _OTHER_ETAG:
+            return self._other_etags.get(suffix), size
+        return _unpack_etag(raw_digest, part_count), size
+
+    def __contains__(self, key):
+        return self._position(key)[1] >= 0
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __iter__(self):
+        offsets = self._offsets
+        for position in range(len(self)):
+            suffix = self._blob[offsets[position]:offsets[position + 1]]
+            yield f'{self.prefix}{suffix.decode()}'
+
+
+class PrefixIndex:
+    # Lists only the remote folders that local files map to, one
+    # list_objects_v2 page per 1000 keys, and keeps the listings of the last
+    # few folders. Files are scanned folder by folder, so memory stays bounded
+    # without paying a head_object per file.
+    def __init__(self, s3_client, bucket, max_folders=16):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.max_folders = max_folders
+        self._folders = OrderedDict()
+        # folder -> Event set once the thread listing it is done
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def _folder_index(self, key):
+        folder = key[:key.rfind('/') + 1]
+        while True:
+            with self._lock:
+                remote_index = self._folders.get(folder)
+                if remote_index is not None:
+                    self._folders.move_to_end(folder)
+                    return remote_index
+                loading = self._loading.get(folder)
+                if loading is None:
+                    # This thread lists the folder, the others wait for it
+                    loading = self._loading[folder] = threading.Event()
+                    break
+            loading.wait()
+
+        try:
+            remote_index = RemoteIndex(folder)
+            for content in s3.list_objects_s3(self.s3_client, self.bucket,
+                    folder, delimiter='/'):
+                remote_index.add(content['Key'], content.get('ETag'),
+                    content.get('Size'))
+
+            with self._lock:
+                self._folders[folder] = remote_index
+                while len(self._folders) > self.max_folders:
+                    self._folders.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._loading[folder]
+            loading.set()
+        return remote_index
+
+    def add(self, key, etag=None, size=None):
+        # Only folders still in memory need to know about new keys
+        folder = key[:key.rfind('/') + 1]
+        with self._lock:
+            remote_index = self._folders.get(folder)
+        if remote_index is not None:
+            remote_index.add(key, etag, size)
+
+    def get(self, key):
+        return self._folder_index(key).get(key)
+
+    def __contains__(self, key):
+        return key in self._folder_index(key)
+
+
+def load_remote_index(s3_client, bucket, folder_path):
+    remote_index = RemoteIndex(folder_path)
+    for content in s3.list_objects_s3(s3_client, bucket, folder_path):
+        remote_index.add(content['Key'], content.get('ETag'),
+            content.get('Size'))
+    return remote_index
+
+
+class ListingIndex:
+    # Lists an S3 folder in the background, split in contiguous key ranges
+    # (start_after, last] that are listed concurrently. Listing starts at
+    # once with a single range. Meanwhile a few '/' delimiter requests look
+    # for remote subfolders, which become the split points of the rest of
+    # it, and a range whose first page is a single folder is split again by
+    # the first character of the names that follow. A lookup only waits for
+    # the range of its key, so files whose range is listed are checked and
+    # uploaded while the rest of the listing runs.
+    def __init__(self, s3_client, bucket, folder_path, workers=8,
+            metrics=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = folder_path
+        self.workers = workers
+        self.metrics = metrics
+        self.remote_index = RemoteIndex(folder_path)
+        # start_after -> [last, done, splittable, last key listed], '' is
+        # the start of the folder
+        self._ranges = {}
+        self._starts = []
+        self._running = 0
+        self._start = time.perf_counter()
+        self._error = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        with self._cond:
+            self._add_ranges([''], None, workers > 1)
+            if workers > 1:
+                self._submit(self._probe)
+
+    def _submit(self, fn, *args):
+        # Called with the lock held
+        self._running += 1
+        self._executor.submit(self._run, fn, *args)
+
+    def _run(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as ex:
+            with self._cond:
+                self._error = ex
+        with self._cond:
+            self._running -= 1
+            if self._running == 0 and self.metrics is not None:
+                self.metrics.add_time('list', time.perf_counter() -
+                    self._start)
+            self._cond.notify_all()
+
+    def _add_ranges(self, bounds, last, splittable=False):
+        # Called with the lock held, bounds are sorted start_after values
+        for start_after, end in zip(bounds, bounds[1:] + [last]):
+            self._ranges[start_after] = [end, False, splittable, None]
+            bisect.insort(self._starts, start_after)
+            self._submit(self._list_range, start_after)
+        self._cond.notify_all()
+
+    def _narrow(self, start_after, bounds, splittable):
+        # Gives the keys after the sorted bounds to new ranges, leaving out
+        # the bounds the range has already listed past
+        with self._cond:
+            current = self._ranges[start_after]
+            if current[1] or self._closed:
+                return
+            bounds = [bound for bound in bounds
+                if (current[3] is None or bound > current[3]) and
+                (current[0] is None or bound < current[0])]
+            if bounds:
+                self._add_ranges(bounds, current[0], splittable)
+                current[0] = bounds[0]
+
+    def _subfolders(self, prefix):
+        # Subfolders in the first page of prefix
+        response = next(s3.list_pages(self.s3_client, self.bucket, prefix,
+            delimiter='/'))
+        return [item['Prefix'] for item in response.get('CommonPrefixes', [])]
+
+    def _probe(self):
+        # Goes down the remote tree, one request per folder of a level, until
+        # there are enough subfolders to give every worker a range
+        bounds, level = [], [self.prefix]
+        for _ in range(PROBE_DEPTH):
+            if self._ranges[''][1]:
+                # Listed before the probe got anywhere
+                return
+            children = sorted(set().union(*self._executor.map(
+                self._subfolders, level)))
+            if not children or len(children) < len(bounds):
+                break
+            bounds = level = children
+            if len(bounds) >= self.workers:
+                break
+
+        step = max(1, -(-len(bounds) // (self.workers * 2)))
+        self._narrow('', bounds[step - 1::step], True)
+
+    def _split(self, start_after, first, seen):
+        # Splits the rest of a range whose page from `first` to `seen` is a
+        # single folder, by the first character of the names of the folder.
+        # Smaller folders are not worth the extra requests.
+        folder = seen[:seen.rfind('/') + 1]
+        if len(folder) < len(self.prefix):
+            folder = self.prefix
+        if not first.startswith(folder):
+            return
+        bounds = [folder + char for char in SPLIT_CHARACTERS]
+        bounds = [bound for bound in bounds if bound > seen]
+        step = max(1, len(bounds) // self.workers)
+        self._narrow(start_after, bounds[step - 1::step], False)
+
+    def _list_range(self, start_after):
+        for response in s3.list_pages(self.s3_client, self.bucket,
+                self.prefix, start_after=start_after or None):
+            if self._closed:
+                return
+            # The end of the range moves when it is split
+            with self._cond:
+                current = self._ranges[start_after]
+                last, splittable = current[0], current[2]
+                current[2] = False
+            contents = response.get('Contents', [])
+            for content in contents:
+                if last is not None and content['Key'] > last:
+                    break
+                self.remote_index.add(content['Key'], content.get('ETag'),
+                    content.get('Size'))
+            if not contents or (last is not None and
+                    contents[-1]['Key'] >= last):
+                break
+            with self._cond:
+                current[3] = contents[-1]['Key']
+            if splittable and response['IsTruncated']:
+                self._split(start_after, contents[0]['Key'],
+                    contents[-1]['Key'])
+
+        with self._cond:
+            self._ranges[start_after][1] = True
+
+    def _wait(self, key):
+        # Waits until the range that holds key is listed
+        if not key.startswith(self.prefix):
+            return
+        with self._cond:
+            while True:
+                if self._error is not None:
+                    raise self._error
+                position = bisect.bisect_left(self._starts, key) - 1
+                if self._ranges[self._starts[position]][1]:
+                    return
+                self._cond.wait()
+
+    def wait(self):
+        # Waits for the whole listing
+        with self._cond:
+            while self._running and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+
+    def add(self, key, etag=None, size=None):
+        self.remote_index.add(key, etag, size)
+
+    def get(self, key):
+        self._wait(key)
+        return self.remote_index.get(key)
+
+    def __contains__(self, key):
+        self._wait(key)
+        return key in self.remote_index
+
+    def close(self):
+        # Stops listing the ranges nobody asked for
+        self._closed = True
+        self._executor.shutdown(wait=False)
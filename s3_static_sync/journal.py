@@ -0,0 +1,84 @@
+import json
+import os
+
+
+def journal_path(manifest_file):
+    return f'{manifest_file}.journal'
+
+
+def _read_header(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            return None
+    return header if isinstance(header, dict) else None
+
+
+def load_journal(path, bucket):
+    # Returns {manifest path: s3 key} of the files an interrupted run
+    # completed. A journal written for another bucket is ignored, and the
+    # line a crash cut in half is dropped.
+    completed = {}
+    if not os.path.exists(path):
+        return completed
+
+    header = _read_header(path)
+    if header is None or header.get('bucket') != bucket:
+        return completed
+
+    with open(path, 'r', encoding='utf-8') as f:
+        next(f)
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(item, list) and len(item) == 2:
+                completed[item[0]] = item[1]
+    return completed
+
+
+class Journal:
+    # Append only record of the files a run has completed, one
+    # ["path", "key"] line each. Lines are fsynced every fsync_every files,
+    # so a killed run loses at most that many, and a restarted run replays
+    # them without any request. Appending keeps the files of every
+    # interrupted attempt until a run completes and removes the journal.
+    def __init__(self, path, bucket, fsync_every=100):
+        self.path = path
+        self.fsync_every = fsync_every
+        self._count = 0
+        header = _read_header(path) if os.path.exists(path) else None
+        if header is not None and header.get('bucket') == bucket:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                complete = f.read(1) == b'\n'
+            self._file = open(path, 'a', encoding='utf-8')
+            if not complete:
+                # Ends the line a crash cut before appending after it
+                self._file.write('\n')
+        else:
+            self._file = open(path, 'w', encoding='utf-8')
+            self._file.write(json.dumps(dict(bucket=bucket)) + '\n')
+            self.sync()
+
+    def add(self, manifest_path, s3_key):
+        self._file.write(json.dumps([manifest_path, s3_key],
+            separators=(',', ':')) + '\n')
+        self._count += 1
+        if self._count % self.fsync_every == 0:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+    def remove(self):
+        # The run completed, its manifest now holds every file
+        self._file.close()
+        os.remove(self.path)
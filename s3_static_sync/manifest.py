@@ -0,0 +1,155 @@
+import json
+import os
+import random
+
+from . import s3
+
+# json: indented JSON object, min: minified JSON object, jsonl: one
+# ["path", "key"] array per line, gzip: minified JSON object, gzipped.
+FORMATS = ['json', 'min', 'jsonl', 'gzip']
+
+GZIP_MAGIC = b'\x1f\x8b'
+# Entries dropped from the end of a truncated JSON object before giving up
+MAX_TRUNCATED_ENTRIES = 100
+
+
+def infer_format(manifest_file):
+    if manifest_file.endswith('.jsonl'):
+        return 'jsonl'
+    if manifest_file.endswith('.gz'):
+        return 'gzip'
+    return 'json'
+
+
+def _parse_truncated(text):
+    # A JSON object cut by a crash: drops the entry it was writing, which
+    # may hold commas of its own
+    end = len(text)
+    for _ in range(MAX_TRUNCATED_ENTRIES):
+        try:
+            data = json.loads(text[:end] + '}')
+        except ValueError as ex:
+            error = ex
+            end = text.rfind(',', 0, end)
+            if end < 0:
+                return {}
+            continue
+        if isinstance(data, dict):
+            return data
+        break
+    raise error
+
+
+def _parse(text):
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # JSON lines, a truncated object, or an empty file
+        data = None
+    if isinstance(data, dict):
+        return data
+    if text.lstrip().startswith('{'):
+        return _parse_truncated(text)
+
+    manifest = {}
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            manifest_path, s3_key = json.loads(line)
+        except ValueError:
+            if i == len(lines) - 1:
+                # The line a crash cut in half
+                break
+            raise
+        manifest[manifest_path] = s3_key
+    return manifest
+
+
+def load_manifest(manifest_file):
+    # Reads every format of ManifestWriter, whatever the file name, and the
+    # temp file a crashed run left
+    with open(manifest_file, 'rb') as f:
+        content = f.read()
+    if content.startswith(GZIP_MAGIC):
+        import zlib
+        # Unlike gzip.decompress, reads a stream without its end
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        content = decompressor.decompress(content)
+        if not decompressor.eof:
+            return _parse(content.decode('utf-8', errors='ignore'))
+    return _parse(content.decode('utf-8'))
+
+
+class ManifestWriter:
+    # Streams entries to <manifest_file>.tmp as they are added and renames
+    # it over the manifest on close, so the whole manifest is never built as
+    # one string and readers never see a half written file. After a crash
+    # the previous manifest is left untouched and the temp file holds the
+    # entries written so far, flushed every flush_every entries.
+    def __init__(self, manifest_file, manifest_format='json',
+            flush_every=1000):
+        if manifest_format not in FORMATS:
+            raise ValueError(f'unknown manifest format {manifest_format}')
+        self.manifest_file = manifest_file
+        self.manifest_format = manifest_format
+        self.flush_every = flush_every
+        self.tmp_path = f'{manifest_file}.tmp'
+        self._count = 0
+        if manifest_format == 'gzip':
+            import gzip
+            self._file = gzip.open(self.tmp_path, 'wt', encoding='utf-8')
+        else:
+            self._file = open(self.tmp_path, 'w', encoding='utf-8')
+
+    def add(self, manifest_path, s3_key):
+        if self.manifest_format == 'jsonl':
+            line = json.dumps([manifest_path, s3_key],
+                separators=(',', ':')) + '\n'
+        elif self.manifest_format == 'json':
+            line = (',\n  ' if self._count else '{\n  ') + \
+                f'{json.dumps(manifest_path)}: {json.dumps(s3_key)}'
+        else:
+            line = (',' if self._count else '{') + \
+                f'{json.dumps(manifest_path)}:{json.dumps(s3_key)}'
+        self._file.write(line)
+        self._count += 1
+        if self._count % self.flush_every == 0:
+            self._file.flush()
+
+    def _end(self):
+        if self.manifest_format == 'jsonl':
+            return ''
+        if self._count == 0:
+            return '{}'
+        return '\n}' if self.manifest_format == 'json' else '}'
+
+    def close(self):
+        self._file.write(self._end())
+        self._file.close()
+        os.replace(self.tmp_path, self.manifest_file)
+
+    def abort(self):
+        # Keeps the temp file with what was written so far, as a complete
+        # document
+        self._file.write(self._end())
+        self._file.close()
+
+
+def write_manifest(manifest_file, manifest, manifest_format='json'):
+    writer = ManifestWriter(manifest_file, manifest_format)
+    try:
+        for manifest_path, s3_key in manifest.items():
+            writer.add(manifest_path, s3_key)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+
+def sample_missing_keys(s3_client, bucket, manifest, sample_size):
+    s3_key_list = list(set(manifest.values()))
+    sample = random.sample(s3_key_list, min(sample_size, len(s3_key_list)))
+    return [s3_key for s3_key in sample
+        if not s3.check_key_exists(s3_client, bucket, s3_key)]
@@ -0,0 +1,178 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf', ), self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+    # Phase times are summed across workers, so with --concurrency they can
+    # add up to more than the wall clock time of the run.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self.phases = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.requests = defaultdict(Histogram)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.phases[name] += seconds
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe_request(self, operation, seconds):
+        with self._lock:
+            self.requests[operation].observe(seconds)
+
+    def timed_iter(self, iterable, name):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def _handlers(self):
+        return (
+            ('before-call.s3', self._before_call),
+            ('after-call.s3', self._after_call),
+            ('after-call-error.s3', self._after_call_error),
+        )
+
+    def instrument_client(self, client):
+        for event_name, handler in self._handlers():
+            client.meta.events.register(event_name, handler)
+
+    def release_client(self, client):
+        # Clients are cached and shared between runs, stop recording on them
+        for event_name, handler in self._handlers():
+            client.meta.events.unregister(event_name, handler)
+
+    def _before_call(self, context, **kwargs):
+        context['metrics_start'] = time.perf_counter()
+
+    def _after_call(self, model, context, parsed=None, **kwargs):
+        start = context.get('metrics_start')
+        if start is not None:
+            self.observe_request(model.name, time.perf_counter() - start)
+        retries = (parsed or {}).get('ResponseMetadata', {}).get(
+            'RetryAttempts', 0)
+        if retries:
+            self.increment('retries', retries)
+
+    def _after_call_error(self, context, **kwargs):
+        self.increment('request_errors')
+
+    def report(self, summary=None):
+        with self._lock:
+            return dict(
+                wall_seconds=round(time.perf_counter() - self._start, 6),
+                phases={name: round(seconds, 6)
+                    for name, seconds in self.phases.items()},
+                counters=dict(self.counters),
+                requests={operation: dict(
+                    count=histogram.count,
+                    sum=round(histogram.sum, 6),
+                    buckets={str(bound): count
+                        for bound, count in histogram.cumulative()})
+                    for operation, histogram in self.requests.items()},
+                summary=dict(summary or {}))
+
+    def to_prometheus(self, summary=None):
+        report = self.report(summary)
+        lines = [
+            '# HELP s3_static_sync_wall_seconds Duration of the sync run',
+            '# TYPE s3_static_sync_wall_seconds gauge',
+            f's3_static_sync_wall_seconds {report["wall_seconds"]}',
+            '# HELP s3_static_sync_phase_seconds Time spent per phase, '
+            'summed across workers',
+            '# TYPE s3_static_sync_phase_seconds gauge',
+        ]
+        for name, seconds in sorted(report['phases'].items()):
+            lines.append(f's3_static_sync_phase_seconds{{phase="{name}"}} '
+                f'{seconds}')
+
+        lines += [
+            '# HELP s3_static_sync_total Counters of the sync run',
+            '# TYPE s3_static_sync_total counter',
+        ]
+        for name, value in sorted(report['counters'].items()):
+            lines.append(f's3_static_sync_total{{counter="{name}"}} {value}')
+
+        lines += [
+            '# HELP s3_static_sync_files Files per status',
+            '# TYPE s3_static_sync_files gauge',
+        ]
+        for name, value in sorted(report['summary'].items()):
+            lines.append(f's3_static_sync_files{{status="{name}"}} {value}')
+
+        lines += [
+            '# HELP s3_static_sync_request_seconds Latency of S3 requests',
+            '# TYPE s3_static_sync_request_seconds histogram',
+        ]
+        for operation, histogram in sorted(report['requests'].items()):
+            for bound, count in histogram['buckets'].items():
+                lines.append('s3_static_sync_request_seconds_bucket'
+                    f'{{operation="{operation}",le="{bound}"}} {count}')
+            lines.append('s3_static_sync_request_seconds_sum'
+                f'{{operation="{operation}"}} {histogram["sum"]}')
+            lines.append('s3_static_sync_request_seconds_count'
+                f'{{operation="{operation}"}} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def write_atomic(path, content):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def write_report(metrics, summary, metrics_file=None, prometheus_file=None):
+    if metrics_file is not None:
+        write_atomic(metrics_file,
+            json.dumps(metrics.report(summary), indent=2))
+    if prometheus_file is not None:
+        write_atomic(prometheus_file, metrics.to_prometheus(summary))
@@ -0,0 +1,104 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from . import sync
+
+_DONE = object()
+
+
+class _Work:
+    def __init__(self, entry):
+        self.entry = entry
+        self.s3_keys = None
+        self.fingerprint = None
+        self.results = None
+
+
+async def _scan(loop, executor, entries, outbox):
+    iterator = iter(entries)
+    while True:
+        entry = await loop.run_in_executor(executor, next, iterator, _DONE)
+        if entry is _DONE:
+            break
+        await outbox.put(_Work(entry))
+    await outbox.put(_DONE)
+
+
+async def _stage(worker_count, handler, inbox, outbox):
+    async def worker():
+        while True:
+            work = await inbox.get()
+            if work is _DONE:
+                # Leave the marker for the sibling workers of this stage
+                await inbox.put(_DONE)
+                return
+            await handler(work)
+            await outbox.put(work)
+
+    await asyncio.gather(*(worker() for _ in range(worker_count)))
+    await outbox.put(_DONE)
+
+
+async def _collect(inbox, on_result):
+    while True:
+        work = await inbox.get()
+        if work is _DONE:
+            return
+        for result in work.results:
+            on_result(result)
+
+
+async def _run(ctx, entries, concurrency, on_result):
+    loop = asyncio.get_running_loop()
+    queue_size = concurrency * 4
+    to_fingerprint = asyncio.Queue(queue_size)
+    to_check = asyncio.Queue(queue_size)
+    to_upload = asyncio.Queue(queue_size)
+    to_manifest = asyncio.Queue(queue_size)
+
+    # Hashing is disk/CPU bound and S3 calls are network bound, each gets
+    # its own pool so both kinds of work overlap.
+    local_executor = ThreadPoolExecutor(max_workers=concurrency)
+    remote_executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def fingerprint(work):
+        work.s3_keys, work.fingerprint = await loop.run_in_executor(
+            local_executor, sync.compose_key, ctx, work.entry)
+
+    async def check(work):
+        work.results = await loop.run_in_executor(remote_executor,
+            sync.check_targets, ctx, work.entry, work.s3_keys,
+            work.fingerprint)
+
+    async def upload(work):
+        work.results = await loop.run_in_executor(remote_executor,
+            sync.upload, ctx, work.entry, work.s3_keys, work.fingerprint,
+            work.results)
+
+    tasks = [
+        loop.create_task(_scan(loop, local_executor, entries, to_fingerprint)),
+        loop.create_task(_stage(concurrency, fingerprint, to_fingerprint,
+            to_check)),
+        loop.create_task(_stage(concurrency, check, to_check, to_upload)),
+        loop.create_task(_stage(concurrency, upload, to_upload, to_manifest)),
+        loop.create_task(_collect(to_manifest, on_result)),
+    ]
+    try:
+        done, pending = await asyncio.wait(tasks,
+            return_when=asyncio.FIRST_EXCEPTION)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            task.result()
+    finally:
+        local_executor.shutdown()
+        remote_executor.shutdown()
+
+
+def run(ctx, entries, concurrency, on_result):
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_run(ctx, entries, concurrency, on_result))
+    finally:
+        loop.close()
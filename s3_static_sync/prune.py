@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+import os
+
+from . import s3
+
+
+def manifest_history(manifest_file, keep):
+    return [f'{manifest_file}.{i}' for i in range(1, keep + 1)]
+
+
+def rotate_manifests(manifest_file, keep):
+    # manifest.json -> manifest.json.1 -> ... -> manifest.json.<keep>, the
+    # oldest one is dropped
+    if keep <= 0 or not os.path.exists(manifest_file):
+        return
+    history = [manifest_file] + manifest_history(manifest_file, keep)
+    for src, dst in reversed(list(zip(history, history[1:]))):
+        if os.path.exists(src):
+            os.replace(src, dst)
+
+
+def referenced_keys(manifests):
+    keys = set()
+    for manifest in manifests:
+        for s3_key in manifest.values():
+            keys.add(s3_key)
+            # Brotli variants live next to the file they were made from
+            keys.add(f'{s3_key}.br')
+    return keys
+
+
+def find_stale_keys(s3_client, bucket, s3_folder, referenced, min_age=0,
+        now=None):
+    # Keys under the folder that no kept manifest references. Objects newer
+    # than min_age seconds are left alone, they may belong to a deploy that
+    # is still running or to pages still served from a cache.
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(seconds=min_age)
+    for content in s3.list_objects_s3(s3_client, bucket, f'{s3_folder}/'):
+        if content['Key'] in referenced:
+            continue
+        if content['LastModified'] > cutoff:
+            continue
+        yield content['Key']
+
+
+def prune(s3_client, bucket, s3_folder, manifests, min_age=0, dry_run=False):
+    # Returns (stale keys, deleted count, [(key, error message)])
+    stale_keys = list(find_stale_keys(s3_client, bucket, s3_folder,
+        referenced_keys(manifests), min_age))
+    if dry_run or not stale_keys:
+        return stale_keys, 0, []
+    deleted, errors = s3.delete_keys(s3_client, bucket, stale_keys)
+    return stale_keys, deleted, errors
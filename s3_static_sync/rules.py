@@ -0,0 +1,177 @@
+from collections import namedtuple
+import json
+import re
+
+# Upload options of a file. Every field takes part in the composed key but
+# acl, which does not change the object body.
+FileOptions = namedtuple('FileOptions',
+    ['acl', 'cache_control', 'expires_delta', 'gzip'])
+
+OVERRIDE_FIELDS = {
+    'acl': str,
+    'cache_control': str,
+    'expires_delta': int,
+    'gzip': bool,
+}
+
+Rule = namedtuple('Rule',
+    ['pattern', 'include', 'exclude', 'upload_last', 'overrides'])
+
+
+def glob_to_regex(pattern):
+    # * and ? stop at /, ** crosses folders. Like in .gitignore, a pattern
+    # without / matches the file name in any folder, a leading / anchors it
+    # to the synced folder and a trailing / matches everything in a folder.
+    anchored = pattern.startswith('/')
+    pattern = pattern.lstrip('/')
+    if pattern.endswith('/'):
+        pattern += '**'
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            parts.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            parts.append(f'[{body}]')
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+
+    regex = ''.join(parts)
+    if not anchored and '/' not in pattern:
+        regex = '(?:.*/)?' + regex
+    return f'^{regex}\\Z'
+
+
+def pattern_to_regex(pattern):
+    # re: patterns are searched in the relative path, everything else is a
+    # glob
+    if pattern.startswith('re:'):
+        return pattern[3:]
+    return glob_to_regex(pattern)
+
+
+def _compile_any(patterns):
+    # One alternation for every pattern, a file costs a single search
+    if not patterns:
+        return None
+    try:
+        return re.compile('|'.join(f'(?:{pattern_to_regex(pattern)})'
+            for pattern in patterns))
+    except re.error as ex:
+        raise ValueError(f'invalid pattern: {ex}')
+
+
+def _extensions(value):
+    if not value:
+        return None
+    return (value, ) if isinstance(value, str) else tuple(value)
+
+
+def load_rules(rules_file):
+    # A JSON list of objects with a pattern and either include/exclude or
+    # any of the OVERRIDE_FIELDS and upload_last.
+    with open(rules_file, 'r', encoding='utf-8') as f:
+        try:
+            items = json.loads(f.read())
+        except ValueError as ex:
+            raise ValueError(f'{rules_file}: {ex}')
+
+    if not isinstance(items, list):
+        raise ValueError(f'{rules_file}: expected a list of rules')
+    rules = []
+    for item in items:
+        if not isinstance(item, dict) or 'pattern' not in item:
+            raise ValueError(f'{rules_file}: every rule needs a pattern')
+        unknown = set(item) - {'pattern', 'include', 'exclude',
+            'upload_last'} - set(OVERRIDE_FIELDS)
+        if unknown:
+            raise ValueError(f'{rules_file}: unknown rule fields '
+                f'{", ".join(sorted(unknown))}')
+        for name, value in item.items():
+            field_type = OVERRIDE_FIELDS.get(name)
+            if field_type is not None and value is not None and \
+                    type(value) is not field_type:
+                raise ValueError(f'{rules_file}: {name} must be a '
+                    f'{field_type.__name__}')
+        rules.append(Rule(item['pattern'], bool(item.get('include')),
+            bool(item.get('exclude')), bool(item.get('upload_last')),
+            {name: item[name] for name in OVERRIDE_FIELDS if name in item}))
+    return rules
+
+
+class Rules:
+    # Filters and per file options compiled once for a whole run. Paths are
+    # relative to the synced folder and use / as separator.
+    def __init__(self, include=(), exclude=(), rules=(),
+            allow_extension=None, ignore_extension=None, defaults=None,
+            upload_last=()):
+        rules = list(rules)
+        self.defaults = defaults or FileOptions('private', None, None, False)
+        self._allow = _extensions(allow_extension)
+        self._ignore = _extensions(ignore_extension)
+        self._include = _compile_any(list(include) +
+            [rule.pattern for rule in rules if rule.include])
+        self._exclude = _compile_any(list(exclude) +
+            [rule.pattern for rule in rules if rule.exclude])
+        self._last = _compile_any(list(upload_last) +
+            [rule.pattern for rule in rules if rule.upload_last])
+        self.has_last = self._last is not None
+        self._overrides = []
+        for rule in rules:
+            if rule.overrides:
+                self._overrides.append((_compile_any([rule.pattern]),
+                    rule.overrides))
+        # Every distinct combination of overrides maps to one FileOptions, so
+        # callers can cache per options values
+        self._options = {(): self.defaults}
+        self.filters_paths = self._include is not None or \
+            self._exclude is not None
+        self.filters = self.filters_paths or self._allow is not None or \
+            self._ignore is not None
+
+    def is_included(self, file_name, relative_path):
+        if self._allow is not None and not file_name.endswith(self._allow):
+            return False
+        if self._ignore is not None and file_name.endswith(self._ignore):
+            return False
+        if self._include is not None and \
+                self._include.search(relative_path) is None:
+            return False
+        return self._exclude is None or \
+            self._exclude.search(relative_path) is None
+
+    def is_last(self, relative_path):
+        # Files uploaded once every other file is
+        return self._last is not None and \
+            self._last.search(relative_path) is not None
+
+    def options(self, relative_path):
+        if not self._overrides:
+            return self.defaults
+
+        matched = tuple(i for i, (regex, _) in enumerate(self._overrides)
+            if regex.search(relative_path) is not None)
+        options = self._options.get(matched)
+        if options is None:
+            # Later rules win
+            values = self.defaults._asdict()
+            for i in matched:
+                values.update(self._overrides[i][1])
+            options = self._options.setdefault(matched, FileOptions(**values))
+        return options
@@ -1,11 +1,12 @@
-import logging
-import boto3
+# boto3, botocore, gzip and mimetypes are imported where they are used:
+# boto3 alone takes a few hundred milliseconds to import, which --help, usage
+# errors and runs that never reach S3 should not pay.
+import base64
 import os
 from datetime import datetime, timedelta
-import gzip
 import io
-import mimetypes
-import botocore
+import threading
+import zlib
 
 
 def normalize_folder_name(folder_name):
@@ -18,30 +19,145 @@ def normalize_folder_name(folder_name):
 
 
 def guess_mime_type(file_name):
+    import mimetypes
     _, ext = os.path.splitext(file_name)
     return mimetypes.types_map.get(f'{ext}', 'binary/octet-stream')
 
 
-def get_client(region):
-    return boto3.client("s3", region_name=region)
+_session = None
+_clients = {}
+_clients_lock = threading.Lock()
 
 
-def gzip_content(content):
+def get_session():
+    # boto3 sessions are not thread safe, every client is created from this
+    # one under _clients_lock.
+    global _session
+    if _session is None:
+        import boto3.session
+        _session = boto3.session.Session()
+    return _session
+
+
+def auto_pool_size(concurrency, multipart_concurrency=4):
+    # Every worker may be running a multipart upload with its own part
+    # threads, botocore's default of 10 connections is the floor.
+    return max(10, concurrency * multipart_concurrency)
+
+
+def get_client(region, max_pool_connections=None, max_attempts=None,
+        connect_timeout=None, read_timeout=None, tcp_keepalive=None,
+        endpoint_url=None, cached=False):
+    options = {}
+    if max_pool_connections is not None:
+        options['max_pool_connections'] = max_pool_connections
+    if max_attempts is not None:
+        options['retries'] = {'mode': 'standard', 'max_attempts': max_attempts}
+    if connect_timeout is not None:
+        options['connect_timeout'] = connect_timeout
+    if read_timeout is not None:
+        options['read_timeout'] = read_timeout
+    if tcp_keepalive is not None:
+        options['tcp_keepalive'] = tcp_keepalive
+
+    # Clients are thread safe, so one client per region and configuration
+    # is shared by every thread.
+    cache_key = (region, endpoint_url, tuple(sorted(
+        (name, repr(value)) for name, value in options.items())))
+    with _clients_lock:
+        client = _clients.get(cache_key) if cached else None
+        if client is None:
+            import botocore.config
+            config = botocore.config.Config(**options) if options else None
+            client = get_session().client("s3", region_name=region,
+                endpoint_url=endpoint_url, config=config)
+            if cached:
+                _clients[cache_key] = client
+    return client
+
+
+def clear_client_cache():
+    with _clients_lock:
+        _clients.clear()
+
+
+class LazyClient:
+    # Stands in for a client and creates it on the first use, so a dry run
+    # fully covered by a previous manifest never imports boto3. on_create is
+    # called with the new client before it is used.
+    def __init__(self, factory, on_create=None):
+        self._factory = factory
+        self._on_create = on_create
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def created(self):
+        return self._client is not None
+
+    def get(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    client = self._factory()
+                    if self._on_create is not None:
+                        self._on_create(client)
+                    self._client = client
+                client = self._client
+        return client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def gzip_content(content, compresslevel=9):
+    import gzip
     out = io.BytesIO()
-    with gzip.GzipFile(fileobj=out, mode="w") as f:
+    with gzip.GzipFile(fileobj=out, mode="w", compresslevel=compresslevel) as f:
         f.write(content)
     return out.getvalue()
 
 
-def upload_file(client, file_name, bucket, object_name, acl,
-        header_cache_control=None, header_expires_delta=None, gzip=False):
+class GzipStream(io.RawIOBase):
+    # Read-only file object that gzips the wrapped file while it is read, so
+    # multipart uploads never hold the whole compressed body in memory.
+    def __init__(self, fileobj, compresslevel=9, chunk_size=1024 * 1024):
+        self._fileobj = fileobj
+        self._compressor = zlib.compressobj(compresslevel, zlib.DEFLATED,
+            16 + zlib.MAX_WBITS)
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or
+                len(self._buffer) < size):
+            chunk = self._fileobj.read(self._chunk_size)
+            if chunk:
+                self._buffer += self._compressor.compress(chunk)
+            else:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+# Largest object copy_object copies in a single request
+MAX_COPY_SIZE = 5 * 1024 ** 3
 
-    with open(file_name, 'rb') as f:
-        content = f.read()
 
+def _object_params(file_name, bucket, object_name, acl, header_cache_control,
+        header_expires_delta, content_encoding):
     params = dict(
         ACL=acl,
-        Body=content,
         Bucket=bucket,
         Key=object_name,
         ContentType=guess_mime_type(file_name)
@@ -53,18 +169,95 @@ def upload_file(client, file_name, bucket, object_name, acl,
     if header_expires_delta is not None:
         params["Expires"] = datetime.now() + timedelta(seconds=header_expires_delta)
 
-    if gzip:
-        params["Body"] = gzip_content(content)
-        params["ContentEncoding"] = "gzip"
+    if content_encoding is not None:
+        params["ContentEncoding"] = content_encoding
+    return params
+
+
+def upload_file(client, file_name, bucket, object_name, acl,
+        header_cache_control=None, header_expires_delta=None, gzip=False,
+        content_md5=None, multipart_threshold=None,
+        multipart_chunksize=8 * 1024 * 1024, multipart_concurrency=4,
+        compresslevel=9, body=None, content_encoding=None):
+
+    params = _object_params(file_name, bucket, object_name, acl,
+        header_cache_control, header_expires_delta,
+        "gzip" if gzip else content_encoding)
+
+    if body is None and multipart_threshold is not None and \
+            os.path.getsize(file_name) >= multipart_threshold:
+        return upload_file_multipart(client, file_name, params,
+            multipart_threshold, multipart_chunksize, multipart_concurrency,
+            compresslevel)
 
     try:
-        client.put_object(**params)
+        if content_md5 is not None and "ContentEncoding" not in params:
+            # Reuse the digest computed while hashing the file name, S3
+            # checks it against the received body.
+            params["ContentMD5"] = base64.b64encode(
+                bytes.fromhex(content_md5)).decode()
+
+        if body is not None:
+            params["Body"] = body
+            client.put_object(**params)
+            return True, None
+
+        with open(file_name, 'rb') as f:
+            if gzip:
+                params["Body"] = gzip_content(f.read(), compresslevel)
+            else:
+                params["Body"] = f
+            client.put_object(**params)
+        return True, None
+    except Exception as ex:
+        return False, str(ex)
+
+
+def upload_file_multipart(client, file_name, params, multipart_threshold,
+        multipart_chunksize, multipart_concurrency, compresslevel=9):
+    import boto3.s3.transfer
+    extra_args = dict(params)
+    bucket = extra_args.pop('Bucket')
+    key = extra_args.pop('Key')
+    config = boto3.s3.transfer.TransferConfig(
+        multipart_threshold=multipart_threshold,
+        multipart_chunksize=multipart_chunksize,
+        max_concurrency=multipart_concurrency)
+
+    # Parts are streamed from disk (through the compressor when gzip is on)
+    # and uploaded in parallel. On failure the transfer manager aborts the
+    # multipart upload, so no orphan parts are left in the bucket.
+    try:
+        with open(file_name, 'rb') as f:
+            fileobj = f
+            if extra_args.get('ContentEncoding') == 'gzip':
+                fileobj = GzipStream(f, compresslevel=compresslevel,
+                    chunk_size=multipart_chunksize)
+            client.upload_fileobj(fileobj, bucket, key, ExtraArgs=extra_args,
+                Config=config)
+        return True, None
+    except Exception as ex:
+        return False, str(ex)
+
+
+def copy_file(client, file_name, bucket, source_key, object_name, acl,
+        header_cache_control=None, header_expires_delta=None,
+        content_encoding=None):
+    # Server side copy of an object with the same body, the headers are set
+    # for file_name as upload_file would.
+    params = _object_params(file_name, bucket, object_name, acl,
+        header_cache_control, header_expires_delta, content_encoding)
+    params["CopySource"] = dict(Bucket=bucket, Key=source_key)
+    params["MetadataDirective"] = "REPLACE"
+    try:
+        client.copy_object(**params)
         return True, None
     except Exception as ex:
         return False, str(ex)
 
 
 def check_key_exists(client, bucket, key):
+    import botocore.exceptions
     try:
         client.head_object(Bucket=bucket, Key=key)
     except botocore.exceptions.ClientError as e:
@@ -76,16 +269,54 @@ def check_key_exists(client, bucket, key):
     return True
 
 
-def list_folder_s3(s3_client, bucket, folder_path):
+def list_pages(s3_client, bucket, folder_path, delimiter=None,
+        start_after=None):
+    # Raw list_objects_v2 responses, one per page of up to 1000 keys
     params = {}
+    if delimiter is not None:
+        params['Delimiter'] = delimiter
+    if start_after is not None:
+        params['StartAfter'] = start_after
     while True:
         response = s3_client.list_objects_v2(Bucket=bucket, Prefix=folder_path,
             **params)
-        if response['KeyCount'] == 0:
-            return
-        for content in response['Contents']:
-            yield content['Key']
+        yield response
         if not response['IsTruncated']:
             return
 
         params['ContinuationToken'] = response['NextContinuationToken']
+
+
+def list_objects_s3(s3_client, bucket, folder_path, delimiter=None):
+    for response in list_pages(s3_client, bucket, folder_path, delimiter):
+        # With a delimiter a page may only contain CommonPrefixes
+        yield from response.get('Contents', [])
+
+
+def list_folder_s3(s3_client, bucket, folder_path):
+    for content in list_objects_s3(s3_client, bucket, folder_path):
+        yield content['Key']
+
+
+def delete_keys(s3_client, bucket, keys, batch_size=1000):
+    # Returns (deleted count, [(key, error message)])
+    deleted = 0
+    errors = []
+
+    def flush(batch):
+        response = s3_client.delete_objects(Bucket=bucket, Delete=dict(
+            Objects=[dict(Key=key) for key in batch], Quiet=True))
+        failed = response.get('Errors', [])
+        errors.extend((error['Key'], error.get('Message', error.get('Code')))
+            for error in failed)
+        return len(batch) - len(failed)
+
+    batch = []
+    for key in keys:
+        batch.append(key)
+        if len(batch) >= batch_size:
+            deleted += flush(batch)
+            batch = []
+    if batch:
+        deleted += flush(batch)
+    return deleted, errors
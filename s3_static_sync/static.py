@@ -1,56 +1,202 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import os
 
+from . import rules as _rules
 
-def scan_folder(folder_path, allow_extension=None, ignore_extension=None):
-    root_absolute_path = os.path.abspath(folder_path)
-    for root, dir_list, file_list in os.walk(root_absolute_path):
-        for file_name in file_list:
-            if allow_extension is not None and not file_name.endswith(tuple(allow_extension)):
+CHUNK_SIZE = 1024 * 1024
+# Folders each scan worker may list ahead of the files being synced
+SCAN_AHEAD = 4
+
+Fingerprint = namedtuple('Fingerprint', ['md5', 'size', 'timestamp'])
+
+FileEntry = namedtuple('FileEntry', ['path', 'manifest_path', 'stat'])
+
+
+def _scan_directory(path, prefix_length, root_length, rules):
+    file_list, dir_list = [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            # Same rules as os.walk: symlinks to folders are not followed
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    dir_list.append(entry.path)
                 continue
 
-            if ignore_extension is not None and file_name.endswith(tuple(ignore_extension)):
+            if rules is not None and not rules.is_included(entry.name,
+                    relative_path(entry.path, root_length)):
                 continue
 
-            absolute_file_path = os.path.join(root, file_name)
-            parent_containing_folder = os.path.dirname(
-                os.path.abspath(root_absolute_path))
-            relative_path = absolute_file_path[len(parent_containing_folder) + 1:]
-            yield absolute_file_path, relative_path
+            file_list.append(FileEntry(entry.path, entry.path[prefix_length:],
+                entry.stat()))
+    return file_list, dir_list
+
+
+def manifest_prefix_length(folder_path):
+    # Manifest paths start with the name of the synced folder
+    return len(os.path.dirname(os.path.abspath(folder_path))) + 1
+
+
+def relative_path(file_path, root_length):
+    # Path inside the synced folder with / separators, as rules expect it
+    if os.sep == '/':
+        return file_path[root_length:]
+    return file_path[root_length:].replace(os.sep, '/')
+
+
+def scan_entries(folder_path, allow_extension=None, ignore_extension=None,
+        workers=1, root_path=None, rules=None):
+    # root_path is the synced folder when only a subfolder of it is scanned.
+    # rules is a compiled rules.Rules, allow/ignore_extension are only used
+    # without it.
+    root_absolute_path = os.path.abspath(folder_path)
+    prefix_length = manifest_prefix_length(root_path or folder_path)
+    root_length = len(os.path.abspath(root_path or folder_path)) + 1
+    if rules is None:
+        rules = _rules.Rules(allow_extension=allow_extension,
+            ignore_extension=ignore_extension)
+    if not rules.filters:
+        rules = None
+
+    def scan(path):
+        return _scan_directory(path, prefix_length, root_length, rules)
+
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    max_ahead = workers * SCAN_AHEAD
+
+    # Entries are yielded in the same top-down order as os.walk. The pool
+    # scans the next folders of the walk ahead, but only max_ahead of them,
+    # so the entries of a wide tree are not all held in memory.
+    try:
+        # [path, Future of its scan or None], the next folder last
+        stack = [[root_absolute_path, None]]
+        ahead = 0
+        while stack:
+            if executor is not None:
+                for item in reversed(stack):
+                    if ahead >= max_ahead:
+                        break
+                    if item[1] is None:
+                        item[1] = executor.submit(scan, item[0])
+                        ahead += 1
+
+            path, future = stack.pop()
+            if future is None:
+                file_list, dir_list = scan(path)
+            else:
+                ahead -= 1
+                file_list, dir_list = future.result()
+            yield from file_list
+            stack.extend([child, None] for child in reversed(dir_list))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def scan_folder(folder_path, allow_extension=None, ignore_extension=None):
+    for entry in scan_entries(folder_path, allow_extension, ignore_extension):
+        yield entry.path, entry.manifest_path
+
 
 def get_md5_content(file_path):
+    md5 = hashlib.md5()
     with open(file_path, 'rb') as f:
-        return hashlib.md5(f.read()).hexdigest()
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
 
 
-def get_timestamp(file_path):
-    return os.path.getmtime(file_path)
+def adjust_chunksize(size, chunksize, max_parts=10000):
+    # Same part size as the boto3 transfer manager picks for a file
+    while -(-size // chunksize) > max_parts:
+        chunksize *= 2
+    return chunksize
 
 
-def get_file_size(file_path):
-    return os.path.getsize(file_path)
+def get_multipart_etag(file_path, chunksize):
+    # ETag S3 gives to a multipart upload: the md5 of the part digests,
+    # followed by the number of parts
+    digests = []
+    with open(file_path, 'rb') as f:
+        for part in iter(lambda: f.read(chunksize), b''):
+            digests.append(hashlib.md5(part).digest())
+    return f'{hashlib.md5(b"".join(digests)).hexdigest()}-{len(digests)}'
 
 
-def compose_file_name(folder_path, s3_folder_path, file_path,
-        header_cache_control, header_expires_delta, use_gzip, use_content,
-        use_size, use_timestamp):
-    file_name = os.path.basename(file_path)
-    file_name_root, file_ext = os.path.splitext(file_name)
+def get_timestamp(file_path, stat_result=None):
+    if stat_result is not None:
+        return stat_result.st_mtime
+    return os.path.getmtime(file_path)
+
 
-    key = f'{header_cache_control}-{header_expires_delta}-{use_gzip}'
+def get_file_size(file_path, stat_result=None):
+    if stat_result is not None:
+        return stat_result.st_size
+    return os.path.getsize(file_path)
 
-    if use_content:
-        key += get_md5_content(file_path)
 
-    if use_size:
-        key += str(get_file_size(file_path))
+def get_fingerprint(file_path, use_content, use_size, use_timestamp,
+        md5=None, stat_result=None):
+    if use_content and md5 is None:
+        md5 = get_md5_content(file_path)
+
+    return Fingerprint(
+        md5=md5 if use_content else None,
+        size=get_file_size(file_path, stat_result) if use_size else None,
+        timestamp=get_timestamp(file_path, stat_result) if use_timestamp else None)
+
+
+class KeyComposer:
+    # compose_file_name for a whole run. The length of the folder path and
+    # the key prefix of every FileOptions are computed once, a file only
+    # costs its digest and a split of its path. With brotli the keys change,
+    # so objects uploaded without their .br variant are uploaded again.
+    def __init__(self, folder_path, s3_folder_path, use_content, use_size,
+            use_timestamp, brotli=False):
+        self.s3_folder_path = s3_folder_path
+        self.use_content = use_content
+        self.use_size = use_size
+        self.use_timestamp = use_timestamp
+        self.brotli = brotli
+        self._folder_length = len(os.path.abspath(folder_path))
+        self._prefixes = {}
+
+    def _key_prefix(self, options):
+        prefix = self._prefixes.get(options)
+        if prefix is None:
+            prefix = f'{options.cache_control}-{options.expires_delta}-' \
+                f'{options.gzip}'
+            if self.brotli:
+                prefix += '-br'
+            prefix = self._prefixes.setdefault(options, prefix)
+        return prefix
+
+    def compose(self, file_path, fingerprint, options):
+        key = self._key_prefix(options)
+        if self.use_content:
+            key += fingerprint.md5
+        if self.use_size:
+            key += str(fingerprint.size)
+        if self.use_timestamp:
+            key += str(fingerprint.timestamp)
+
+        file_hash = hashlib.md5(key.encode()).hexdigest()
+        folder, _, file_name = file_path.rpartition(os.sep)
+        file_name_root, file_ext = os.path.splitext(file_name)
+        return f'{self.s3_folder_path}{folder[self._folder_length:]}{os.sep}' \
+            f'{file_name_root}-{file_hash}{file_ext}'
 
-    if use_timestamp:
-        key += str(get_timestamp(file_path))
 
-    file_hash = hashlib.md5(key.encode()).hexdigest()
-    absolute_folder_path = os.path.abspath(folder_path)
-    new_file_name = f'{file_name_root}-{file_hash}{file_ext}'
-    new_file_path = os.path.join(os.path.dirname(file_path),
-        new_file_name)[len(absolute_folder_path):]
-    return f'{s3_folder_path}{new_file_path}'
+def compose_file_name(folder_path, s3_folder_path, file_path,
+        header_cache_control, header_expires_delta, use_gzip, use_content,
+        use_size, use_timestamp, fingerprint=None):
+    if fingerprint is None:
+        fingerprint = get_fingerprint(file_path, use_content, use_size,
+            use_timestamp)
+
+    composer = KeyComposer(folder_path, s3_folder_path, use_content, use_size,
+        use_timestamp)
+    return composer.compose(os.path.abspath(file_path), fingerprint,
+        _rules.FileOptions(None, header_cache_control, header_expires_delta,
+            use_gzip))
@@ -0,0 +1,491 @@
+from collections import deque, namedtuple
+from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor,
+    as_completed, wait)
+import os
+import threading
+
+from . import compress
+from . import dedup as _dedup
+from . import metrics as _metrics
+from . import rules as _rules
+from . import s3
+from . import static
+
+SKIPPED = 'skipped'
+UPLOADED = 'uploaded'
+COPIED = 'copied'
+ERROR = 'error'
+
+# scan: files are synced in scan order. largest-first: the whole scan is
+# collected and sorted by size, so the largest files start first.
+SCHEDULES = ['scan', 'largest-first']
+
+SyncResult = namedtuple('SyncResult',
+    ['file_path', 'manifest_path', 's3_key', 'status', 'error', 'target'])
+
+# Body shared by every target of a file. body is None when the file is
+# streamed from disk, gzipped on the fly if stream_gzip is set.
+Payload = namedtuple('Payload',
+    ['body', 'content_encoding', 'brotli_body', 'stream_gzip'])
+
+
+class Target:
+    def __init__(self, client, bucket, s3_folder, remote_index=None,
+            previous_manifest=None, manifest_file=None, completed=None,
+            keep_manifest=True):
+        self.client = client
+        self.bucket = bucket
+        self.s3_folder = s3_folder
+        self.remote_index = remote_index
+        self.previous_manifest = previous_manifest
+        self.manifest_file = manifest_file
+        # Files completed by an interrupted run, replayed from its journal
+        self.completed = completed
+        # Manifests are streamed by manifest_writer, the whole dict is only
+        # kept for the runs that read it back
+        self.manifest = {} if keep_manifest else None
+        self.manifest_writer = None
+        self.journal = None
+        self.summary = dict(total=0, skipped=0, uploaded=0, copied=0,
+            error=0)
+
+    @property
+    def label(self):
+        return f's3://{self.bucket}/{self.s3_folder}'
+
+    def key(self, key_suffix):
+        return f'{self.s3_folder}{key_suffix}'
+
+    def key_exists(self, s3_key):
+        if self.remote_index is not None:
+            return s3_key in self.remote_index
+        return s3.check_key_exists(self.client, self.bucket, s3_key)
+
+    def add_to_manifest(self, manifest_path, s3_key):
+        if self.manifest is not None:
+            self.manifest[manifest_path] = s3_key
+        if self.manifest_writer is not None:
+            self.manifest_writer.add(manifest_path, s3_key)
+        if self.journal is not None:
+            self.journal.add(manifest_path, s3_key)
+
+    def add_key(self, s3_key):
+        # Keeps the index current for the next batches of a watch run
+        if self.remote_index is not None:
+            self.remote_index.add(s3_key)
+
+    def _vouched(self, manifest_path, s3_key):
+        # A key already published by the previous run or by an interrupted
+        # one for the same path means the fingerprint did not change.
+        return any(manifest is not None and
+            manifest.get(manifest_path) == s3_key
+            for manifest in (self.completed, self.previous_manifest))
+
+    def listed_object(self, manifest_path, s3_key):
+        # (etag, size) of s3_key in the remote listing, None when the key was
+        # vouched for by a manifest, the journal or a head request
+        if self.remote_index is None or \
+                self._vouched(manifest_path, s3_key):
+            return None
+        return self.remote_index.get(s3_key)
+
+    def is_published(self, manifest_path, s3_key):
+        # No remote call is needed for a vouched key
+        if self._vouched(manifest_path, s3_key):
+            return True
+        return self.key_exists(s3_key)
+
+
+class SyncContext:
+    def __init__(self, local_folder, acl, sync_strategy, targets,
+            header_cache_control=None, header_expires_delta=None, gzip=False,
+            dry_run=False, hash_cache=None, multipart_threshold=None,
+            multipart_chunksize=8 * 1024 * 1024, compressor=None,
+            metrics=None, fanout_workers=None, rules=None, dedup=False,
+            verify=False):
+        self.local_folder = local_folder
+        self.acl = acl
+        self.sync_strategy = sync_strategy
+        self.targets = targets
+        self.header_cache_control = header_cache_control
+        self.header_expires_delta = header_expires_delta
+        self.gzip = gzip
+        self.dry_run = dry_run
+        self.hash_cache = hash_cache
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = multipart_chunksize
+        self.compressor = compressor or compress.Compressor()
+        self.metrics = metrics or _metrics.Metrics()
+        self.rules = rules or _rules.Rules(defaults=_rules.FileOptions(acl,
+            header_cache_control, header_expires_delta, gzip))
+        self.key_composer = static.KeyComposer(local_folder, '',
+            'content' in sync_strategy, 'size' in sync_strategy,
+            'timestamp' in sync_strategy, self.compressor.brotli)
+        self._root_length = len(os.path.abspath(local_folder)) + 1
+        self.dedup = _dedup.Deduplicator() if dedup else None
+        self.verify = verify
+        self._fanout = None
+        if len(targets) > 1:
+            self._fanout = ThreadPoolExecutor(
+                max_workers=fanout_workers or len(targets) * 4)
+
+    def map_targets(self, fn, *iterables):
+        if self._fanout is None:
+            return list(map(fn, self.targets, *iterables))
+        return list(self._fanout.map(fn, self.targets, *iterables))
+
+    def file_options(self, entry):
+        return self.rules.options(static.relative_path(entry.path,
+            self._root_length))
+
+    def is_last(self, entry):
+        return self.rules.is_last(static.relative_path(entry.path,
+            self._root_length))
+
+    def close(self):
+        if self._fanout is not None:
+            self._fanout.shutdown()
+        self.compressor.close()
+
+
+def compose_key(ctx, entry):
+    # Returns one key per target, the file is fingerprinted only once
+    file_path, manifest_path = entry.path, entry.manifest_path
+    composer = ctx.key_composer
+    use_content = composer.use_content
+    md5 = None
+    with ctx.metrics.phase('hash'):
+        if use_content and ctx.hash_cache is not None:
+            md5 = ctx.hash_cache.get_md5(manifest_path, file_path, entry.stat)
+        fingerprint = static.get_fingerprint(file_path, use_content,
+            composer.use_size, composer.use_timestamp, md5=md5,
+            stat_result=entry.stat)
+
+    key_suffix = composer.compose(file_path, fingerprint,
+        ctx.file_options(entry))
+    return [target.key(key_suffix) for target in ctx.targets], fingerprint
+
+
+class LocalObject:
+    # The object the sync would upload for a file, compared with the ETag
+    # and size of the remote listing. Digests are computed on first use and
+    # shared by the targets.
+    def __init__(self, ctx, entry, fingerprint):
+        self.ctx = ctx
+        self.entry = entry
+        self.fingerprint = fingerprint
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, fn):
+        with self._lock:
+            if name not in self._values:
+                self._values[name] = fn()
+            return self._values[name]
+
+    def _gzip_size(self):
+        # Size of the gzipped body, None when the file is sent uncompressed
+        ctx, entry = self.ctx, self.entry
+        options = ctx.file_options(entry)
+        if not options.gzip or not ctx.compressor.is_compressible(entry.path):
+            return None
+        with open(entry.path, 'rb') as f:
+            if ctx.multipart_threshold is not None and \
+                    entry.stat.st_size >= ctx.multipart_threshold:
+                stream = s3.GzipStream(f, ctx.compressor.level,
+                    ctx.multipart_chunksize)
+                return sum(len(chunk) for chunk in
+                    iter(lambda: stream.read(static.CHUNK_SIZE), b''))
+            compressed = ctx.compressor.gzip(f.read())
+        return None if compressed is None else len(compressed)
+
+    def _md5(self):
+        return self.fingerprint.md5 or static.get_md5_content(self.entry.path)
+
+    def matches(self, etag, size):
+        if etag is None:
+            # Added by this run, not listed
+            return True
+        gzip_size = self._get('gzip', self._gzip_size)
+        if gzip_size is not None:
+            # gzip headers hold a timestamp, only the size is reproducible
+            return size == gzip_size
+
+        file_size = self.entry.stat.st_size
+        if size != file_size:
+            return False
+        if '-' not in etag:
+            return etag == self._get('md5', self._md5)
+
+        try:
+            part_count = int(etag.rsplit('-', 1)[1])
+        except ValueError:
+            return True
+        chunksize = static.adjust_chunksize(file_size,
+            self.ctx.multipart_chunksize)
+        if -(-file_size // chunksize) != part_count:
+            # Uploaded with another part size, only the size can be checked
+            return True
+        return etag == self._get(chunksize, lambda:
+            static.get_multipart_etag(self.entry.path, chunksize))
+
+
+def check_targets(ctx, entry, s3_keys, fingerprint=None):
+    # One result per target, None where the file still has to be uploaded.
+    # With ctx.verify, listed objects that do not match the file are
+    # uploaded again.
+    local_object = None
+    if ctx.verify and fingerprint is not None:
+        local_object = LocalObject(ctx, entry, fingerprint)
+
+    def check(target, s3_key):
+        with ctx.metrics.phase('exists'):
+            published = target.is_published(entry.manifest_path, s3_key)
+            listed = None
+            if published and local_object is not None:
+                listed = target.listed_object(entry.manifest_path, s3_key)
+        if listed is not None:
+            with ctx.metrics.phase('verify'):
+                published = local_object.matches(*listed)
+            if not published:
+                ctx.metrics.increment('verify_mismatches')
+        if published:
+            return SyncResult(entry.path, entry.manifest_path, s3_key,
+                SKIPPED, None, target)
+        return None
+
+    return ctx.map_targets(check, s3_keys)
+
+
+def _prepare_payload(ctx, entry, options):
+    compressor = ctx.compressor
+    compressible = compressor.is_compressible(entry.path)
+    large = ctx.multipart_threshold is not None and \
+        entry.stat.st_size >= ctx.multipart_threshold
+    if large or not compressible or not (options.gzip or compressor.brotli):
+        # Large files are compressed while they are streamed
+        return Payload(None, None, None, options.gzip and compressible)
+
+    with open(entry.path, 'rb') as f:
+        content = f.read()
+
+    body, content_encoding, brotli_body = content, None, None
+    with ctx.metrics.phase('compress'):
+        if options.gzip:
+            compressed = compressor.gzip(content)
+            if compressed is not None:
+                body, content_encoding = compressed, 'gzip'
+        if compressor.brotli:
+            brotli_body = compressor.brotli_variant(content)
+    return Payload(body, content_encoding, brotli_body, False)
+
+
+def _upload(ctx, target, entry, s3_key, fingerprint, payload, options):
+    params = dict(
+        header_cache_control=options.cache_control,
+        header_expires_delta=options.expires_delta,
+        content_md5=fingerprint.md5,
+        multipart_threshold=ctx.multipart_threshold,
+        multipart_chunksize=ctx.multipart_chunksize,
+        compresslevel=ctx.compressor.level)
+
+    with ctx.metrics.phase('upload'):
+        success, err = s3.upload_file(target.client, entry.path,
+            target.bucket, s3_key, options.acl, gzip=payload.stream_gzip,
+            body=payload.body, content_encoding=payload.content_encoding,
+            **params)
+    if success:
+        # Streamed files are counted before compression
+        ctx.metrics.increment('bytes_sent', entry.stat.st_size
+            if payload.body is None else len(payload.body))
+
+    if success and payload.brotli_body is not None:
+        params['content_md5'] = None
+        with ctx.metrics.phase('upload'):
+            success, err = s3.upload_file(target.client, entry.path,
+                target.bucket, f'{s3_key}.br', options.acl,
+                body=payload.brotli_body, content_encoding='br', **params)
+        if success:
+            ctx.metrics.increment('bytes_sent', len(payload.brotli_body))
+    return success, err
+
+
+def _payload_size(entry, payload):
+    # Streamed files are counted before compression
+    size = entry.stat.st_size if payload.body is None else len(payload.body)
+    if payload.brotli_body is not None:
+        size += len(payload.brotli_body)
+    return size
+
+
+def _copy(ctx, target, entry, s3_key, source, options):
+    with ctx.metrics.phase('upload'):
+        success, err = s3.copy_file(target.client, entry.path, target.bucket,
+            source.s3_key, s3_key, options.acl,
+            header_cache_control=options.cache_control,
+            header_expires_delta=options.expires_delta,
+            content_encoding=source.content_encoding)
+        if success and source.has_brotli:
+            success, err = s3.copy_file(target.client, entry.path,
+                target.bucket, f'{source.s3_key}.br', f'{s3_key}.br',
+                options.acl, header_cache_control=options.cache_control,
+                header_expires_delta=options.expires_delta,
+                content_encoding='br')
+    if success:
+        ctx.metrics.increment('dedup_copies')
+        ctx.metrics.increment('bytes_deduplicated', source.size)
+    return success, err
+
+
+def _blob_key(ctx, entry, fingerprint, options):
+    # Identical content gives an identical body as long as the same
+    # compression applies, None when the file cannot be deduplicated
+    if ctx.dedup is None or fingerprint.md5 is None or \
+            entry.stat.st_size >= s3.MAX_COPY_SIZE:
+        return None
+    return (fingerprint.md5,
+        bool(options.gzip) and ctx.compressor.is_compressible(entry.path))
+
+
+def _send(ctx, target, entry, s3_key, fingerprint, options, get_payload,
+        blob_key):
+    # Returns (status, error)
+    owner = False
+    if blob_key is not None:
+        owner, source = ctx.dedup.claim(target.bucket, blob_key)
+        if source is not None:
+            success, err = _copy(ctx, target, entry, s3_key, source, options)
+            if success:
+                return COPIED, None
+            # The file is uploaded when the copy fails
+
+    success, payload = False, None
+    try:
+        payload = get_payload()
+        success, err = _upload(ctx, target, entry, s3_key, fingerprint,
+            payload, options)
+    finally:
+        if owner:
+            if success:
+                ctx.dedup.done(target.bucket, blob_key, s3_key,
+                    content_encoding='gzip' if payload.stream_gzip else
+                    payload.content_encoding,
+                    has_brotli=payload.brotli_body is not None,
+                    size=_payload_size(entry, payload))
+            else:
+                ctx.dedup.done(target.bucket, blob_key)
+    return UPLOADED if success else ERROR, err
+
+
+def upload(ctx, entry, s3_keys, fingerprint, results):
+    # Fills the missing results of check_targets, the body is read and
+    # compressed once, when a target first needs it, and sent to every
+    # target that misses the file.
+    if all(result is not None for result in results):
+        return results
+
+    options = ctx.file_options(entry)
+    blob_key = _blob_key(ctx, entry, fingerprint, options)
+    payload = []
+    payload_lock = threading.Lock()
+
+    def get_payload():
+        with payload_lock:
+            if not payload:
+                payload.append(_prepare_payload(ctx, entry, options))
+        return payload[0]
+
+    def send(target, s3_key, result):
+        if result is not None:
+            return result
+        if ctx.dry_run:
+            status, err = UPLOADED, None
+        else:
+            status, err = _send(ctx, target, entry, s3_key, fingerprint,
+                options, get_payload, blob_key)
+        return SyncResult(entry.path, entry.manifest_path, s3_key, status,
+            err, target)
+
+    return ctx.map_targets(send, s3_keys, results)
+
+
+def sync_file(ctx, entry):
+    s3_keys, fingerprint = compose_key(ctx, entry)
+    results = check_targets(ctx, entry, s3_keys, fingerprint)
+    return upload(ctx, entry, s3_keys, fingerprint, results)
+
+
+def schedule(ctx, entries, order='scan', by_folder=False):
+    # Groups of entries to sync one after the other. Files matching an
+    # upload_last rule are the last group, published once every file they
+    # may reference is. With largest-first each group is sorted by size and
+    # every free worker takes the largest file left (longest processing time
+    # first), so a large file never starts at the end of the run while the
+    # other workers sit idle. With by_folder the files of a folder stay
+    # together, for lookups that list a few folders at a time.
+    last = []
+    if ctx.rules.has_last:
+        entries = _defer(ctx, entries, last)
+    if order == 'largest-first':
+        entries = _largest_first(entries, by_folder)
+    yield entries
+    if last:
+        yield (_largest_first(last, by_folder) if order == 'largest-first'
+            else last)
+
+
+def _defer(ctx, entries, last):
+    for entry in entries:
+        if ctx.is_last(entry):
+            last.append(entry)
+        else:
+            yield entry
+
+
+def _largest_first(entries, by_folder=False):
+    # The sort is stable, files of the same size keep their scan order
+    entries = sorted(entries, key=lambda entry: entry.stat.st_size,
+        reverse=True)
+    if not by_folder:
+        return entries
+    # Folders by their largest file, then each folder by size
+    folders = {}
+    for entry in entries:
+        folders.setdefault(os.path.dirname(entry.path), []).append(entry)
+    return [entry for folder in folders.values() for entry in folder]
+
+
+def sync_files(ctx, entries, concurrency=1, ordered=True):
+    # With ordered=False results are handed back as files complete, so a
+    # long upload never holds back the window of the files behind it.
+    if concurrency <= 1:
+        for entry in entries:
+            yield from sync_file(ctx, entry)
+        return
+
+    max_pending = concurrency * 4
+    if not ordered:
+        pending = set()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for entry in entries:
+                pending.add(executor.submit(sync_file, ctx, entry))
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending,
+                        return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+            for future in as_completed(pending):
+                yield from future.result()
+        return
+
+    # Keep a bounded window of in-flight files and hand results back in scan
+    # order, so the manifest and the output match the sequential path.
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for entry in entries:
+            pending.append(executor.submit(sync_file, ctx, entry))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
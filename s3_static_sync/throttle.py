@@ -0,0 +1,144 @@
+import functools
+import random
+import threading
+import time
+
+THROTTLE_CODES = {
+    '503',
+    'RequestLimitExceeded',
+    'ServiceUnavailable',
+    'SlowDown',
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequests',
+}
+RETRYABLE_CODES = THROTTLE_CODES | {
+    '500',
+    '502',
+    '504',
+    'InternalError',
+    'RequestTimeout',
+}
+
+# Client calls that go through the retry/throttle layer. Multipart uploads
+# are included because the transfer manager calls them on this client.
+RETRIED_OPERATIONS = {
+    'abort_multipart_upload',
+    'complete_multipart_upload',
+    'copy_object',
+    'create_multipart_upload',
+    'delete_objects',
+    'head_object',
+    'list_objects_v2',
+    'put_object',
+    'upload_part',
+}
+
+
+class AdaptiveLimiter:
+    # AIMD concurrency limit: every success adds 1/limit (so +1 per window of
+    # `limit` requests) and a throttled response halves it, at most once per
+    # cooldown so a burst of SlowDown replies counts as a single signal.
+    def __init__(self, max_limit, min_limit=1, cooldown=1.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.cooldown = cooldown
+        self.limit = float(max_limit)
+        self._in_flight = 0
+        self._last_decrease = None
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if self._last_decrease is None or \
+                        now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=5, base_delay=0.1, max_delay=20.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.max_delay,
+            self.base_delay * 2 ** attempt))
+
+
+def classify_error(ex):
+    # Returns (retryable, throttled)
+    import botocore.exceptions
+    if isinstance(ex, botocore.exceptions.ClientError):
+        error = ex.response.get('Error', {})
+        status = ex.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        code = str(error.get('Code'))
+        throttled = code in THROTTLE_CODES or status == 503
+        return throttled or code in RETRYABLE_CODES or \
+            (status is not None and status >= 500), throttled
+    if isinstance(ex, (botocore.exceptions.ConnectionError,
+            botocore.exceptions.HTTPClientError)):
+        return True, False
+    return False, False
+
+
+class ThrottledClient:
+    # Wraps a boto3 S3 client, the calls in RETRIED_OPERATIONS share one
+    # adaptive limiter and are retried with jittered exponential backoff.
+    # Everything else is forwarded untouched.
+    def __init__(self, client, limiter, policy=None, metrics=None):
+        self._client = client
+        self.limiter = limiter
+        self.policy = policy or RetryPolicy()
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name in RETRIED_OPERATIONS:
+            return functools.partial(self._call, attr)
+        return attr
+
+    def upload_fileobj(self, *args, **kwargs):
+        # Run the transfer manager against this wrapper so multipart parts
+        # are throttled and retried too.
+        import boto3.s3.inject
+        return boto3.s3.inject.upload_fileobj(self, *args, **kwargs)
+
+    def _call(self, method, **kwargs):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            throttled = False
+            try:
+                return method(**kwargs)
+            except Exception as ex:
+                retryable, throttled = classify_error(ex)
+                if not retryable or attempt + 1 >= self.policy.max_attempts:
+                    raise
+            finally:
+                self.limiter.release(throttled)
+
+            if self.metrics is not None:
+                self.metrics.increment('retries')
+                if throttled:
+                    self.metrics.increment('throttled')
+
+            body = kwargs.get('Body')
+            if hasattr(body, 'seek'):
+                body.seek(0)
+            time.sleep(self.policy.delay(attempt))
+            attempt += 1
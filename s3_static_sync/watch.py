@@ -0,0 +1,173 @@
+from abc import ABC, abstractmethod
+from collections import namedtuple
+import os
+import time
+
+from . import rules as _rules
+from . import static
+
+# Files to sync again and manifest paths that were removed. A removed folder
+# is reported once, every manifest path under it is gone too.
+Batch = namedtuple('Batch', ['entries', 'deleted'])
+
+
+def _stat_key(stat_result):
+    return (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+
+
+class _Watcher(ABC):
+    def __init__(self, folder, rules=None):
+        self.folder = os.path.abspath(folder)
+        self.rules = rules or _rules.Rules()
+        self.prefix_length = static.manifest_prefix_length(self.folder)
+        self.root_length = len(self.folder) + 1
+
+    def scan(self, folder):
+        return static.scan_entries(folder, root_path=self.folder,
+            rules=self.rules)
+
+    def resolve(self, paths):
+        # Turns the changed paths into a Batch. A path may have changed
+        # several times, only its state at this moment matters.
+        entries, deleted = {}, []
+        for path in sorted(paths):
+            try:
+                stat_result = os.stat(path)
+            except FileNotFoundError:
+                deleted.append(path[self.prefix_length:])
+                continue
+
+            if os.path.isdir(path):
+                for entry in self.scan(path):
+                    entries[entry.path] = entry
+            elif self.rules.is_included(os.path.basename(path),
+                    static.relative_path(path, self.root_length)):
+                entries[path] = static.FileEntry(path,
+                    path[self.prefix_length:], stat_result)
+        return Batch(list(entries.values()), deleted)
+
+    @abstractmethod
+    def poll(self, timeout=None):
+        # Returns the set of paths changed since the last call, waiting up to
+        # timeout seconds (forever when None) for the first change.
+        pass
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(_Watcher):
+    # Rescans the whole folder every interval and compares size, mtime and
+    # inode of every file with the previous scan.
+    def __init__(self, folder, rules=None, interval=1.0):
+        super().__init__(folder, rules)
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        return {entry.path: _stat_key(entry.stat)
+            for entry in self.scan(self.folder)}
+
+    def poll(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(self.interval if deadline is None else
+                max(0, min(self.interval, deadline - time.monotonic())))
+            snapshot = self._take_snapshot()
+            changed = {path for path, key in snapshot.items()
+                if self._snapshot.get(path) != key}
+            changed.update(path for path in self._snapshot
+                if path not in snapshot)
+            self._snapshot = snapshot
+            if changed or (deadline is not None and
+                    time.monotonic() >= deadline):
+                return changed
+
+
+class InotifyWatcher(_Watcher):
+    # Linux only, requires the inotify_simple package. Every folder of the
+    # tree gets its own watch, folders created later are added as they show
+    # up.
+    def __init__(self, folder, rules=None):
+        from inotify_simple import INotify, flags
+        super().__init__(folder, rules)
+        self._flags = flags
+        self._mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | \
+            flags.CREATE | flags.DELETE | flags.ATTRIB
+        self._inotify = INotify()
+        self._folders = {}
+        self._add_tree(self.folder)
+
+    def _add_tree(self, folder):
+        for root, dir_list, _ in os.walk(folder):
+            try:
+                wd = self._inotify.add_watch(root, self._mask)
+            except FileNotFoundError:
+                continue
+            self._folders[wd] = root
+
+    def poll(self, timeout=None):
+        flags = self._flags
+        read_timeout = None if timeout is None else int(timeout * 1000)
+        changed = set()
+        for event in self._inotify.read(timeout=read_timeout):
+            folder = self._folders.get(event.wd)
+            if folder is None:
+                continue
+            if event.mask & flags.IGNORED:
+                del self._folders[event.wd]
+                continue
+
+            path = os.path.join(folder, event.name)
+            if event.mask & flags.ISDIR:
+                if event.mask & (flags.CREATE | flags.MOVED_TO):
+                    # Files may be written before the watch is in place, the
+                    # whole new folder is synced.
+                    self._add_tree(path)
+                    changed.add(path)
+                elif event.mask & (flags.DELETE | flags.MOVED_FROM):
+                    changed.add(path)
+            elif not event.mask & flags.CREATE:
+                # A created file is synced once it is closed
+                changed.add(path)
+        return changed
+
+    def close(self):
+        self._inotify.close()
+
+
+def get_watcher(folder, rules=None, interval=1.0):
+    try:
+        return InotifyWatcher(folder, rules)
+    except (ImportError, OSError):
+        return PollingWatcher(folder, rules, interval=interval)
+
+
+def drop_deleted(manifest, deleted):
+    for manifest_path in deleted:
+        if manifest.pop(manifest_path, None) is not None:
+            continue
+        prefix = f'{manifest_path}{os.sep}'
+        for path in [path for path in manifest if path.startswith(prefix)]:
+            del manifest[path]
+
+
+def batches(watcher, debounce=0.5, max_delay=10.0):
+    # Waits for a change, then keeps collecting until the folder has been
+    # quiet for debounce seconds, so a build writing hundreds of files is
+    # synced in one batch. max_delay bounds the wait under constant writes.
+    while True:
+        changed = watcher.poll()
+        if not changed:
+            continue
+
+        deadline = time.monotonic() + max_delay
+        while True:
+            timeout = min(debounce, deadline - time.monotonic())
+            if timeout <= 0:
+                break
+            more = watcher.poll(timeout)
+            if not more:
+                break
+            changed |= more
+        yield watcher.resolve(changed)
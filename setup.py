@@ -21,6 +21,10 @@ setup(
         'boto3',
         'click'
     ],
+    extras_require={
+        'brotli': ['brotli'],
+        'watch': ['inotify_simple']
+    },
     entry_points={
         'console_scripts': [
             's3_static_sync = s3_static_sync.app:runner'
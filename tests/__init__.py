@@ -0,0 +1,5 @@
+import os
+
+# moto 4 does not decode the aws-chunked bodies that recent botocore sends
+# by default, only add request checksums when the operation requires them.
+os.environ.setdefault('AWS_REQUEST_CHECKSUM_CALCULATION', 'when_required')
@@ -1,5 +1,8 @@
+import gzip
 import json
 import os
+import subprocess
+import sys
 import unittest
 from unittest.mock import patch
 
@@ -7,6 +10,7 @@ import boto3
 from click.testing import CliRunner
 from moto import mock_s3
 
+from s3_static_sync import s3, sync
 from s3_static_sync.app import runner
 
 
@@ -75,6 +79,29 @@ class TestRunnerCommand(unittest.TestCase):
         self.assertEqual(result.exit_code, 0)
         self.assertIn('file exist', result.output)
 
+    @mock_s3
+    def test_runner_with_prefix_lookup(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+
+        args = [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--low-memory-mode',
+            '--lookup-mode', 'prefix',
+        ]
+        result = self.runner.invoke(runner, args)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('file uploaded mock_local_folder/test.txt', result.output)
+
+        with patch('s3_static_sync.s3.check_key_exists') as fn:
+            result = self.runner.invoke(runner, args)
+            self.assertFalse(fn.called)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('file exist', result.output)
+
     @mock_s3
     def test_runner_gzip(self):
         self.s3 = boto3.resource('s3', region_name=self.mock_region)
@@ -92,6 +119,30 @@ class TestRunnerCommand(unittest.TestCase):
         self.assertEqual(result.exit_code, 0)
         self.assertIn('file uploaded mock_local_folder/test.txt', result.output)
 
+    @mock_s3
+    def test_runner_gzip_skip_incompressible(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+        png_path = os.path.join(self.mock_local_folder, 'image.png')
+        with open(png_path, 'wb') as f:
+            f.write(b'Hello, World!' * 100)
+
+        try:
+            with patch('s3_static_sync.s3.gzip_content') as fn:
+                result = self.runner.invoke(runner, [
+                    '--bucket', self.mock_bucket,
+                    '--bucket-region', self.mock_region,
+                    '--local-folder', self.mock_local_folder,
+                    '--s3-folder', self.mock_s3_folder,
+                    '--gzip',
+                    '--allow-extension', '.png',
+                ])
+                self.assertFalse(fn.called)
+        finally:
+            os.remove(png_path)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('file uploaded mock_local_folder/image.png', result.output)
+
     @mock_s3
     def test_runner_manifest(self):
         self.s3 = boto3.resource('s3', region_name=self.mock_region)
@@ -132,6 +183,704 @@ class TestRunnerCommand(unittest.TestCase):
                     self.assertTrue(fn3.called)
         self.assertEqual(result.exit_code, 0)
 
+    @mock_s3
+    def test_runner_concurrency(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+
+        extra_files = []
+        for i in range(10):
+            file_path = os.path.join(self.mock_local_folder, f'file-{i}.txt')
+            with open(file_path, 'w') as f:
+                f.write(f'content {i}')
+            extra_files.append(file_path)
+
+        try:
+            manifests = []
+            for concurrency in ('1', '4'):
+                result = self.runner.invoke(runner, [
+                    '--bucket', self.mock_bucket,
+                    '--bucket-region', self.mock_region,
+                    '--local-folder', self.mock_local_folder,
+                    '--s3-folder', self.mock_s3_folder,
+                    '--manifest-file', 'x.json',
+                    '--concurrency', concurrency,
+                ])
+                self.assertEqual(result.exit_code, 0)
+                with open('x.json') as f:
+                    manifests.append(f.read())
+            os.remove('x.json')
+
+            self.assertEqual(manifests[0], manifests[1])
+            self.assertIn('==> Total   : 11', result.output)
+            self.assertIn('==> Skipped : 11', result.output)
+        finally:
+            for file_path in extra_files:
+                os.remove(file_path)
+
+    @mock_s3
+    def test_runner_hash_cache(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+        os.utime(self.test_file_path, (1000000000, 1000000000))
+
+        args = [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--manifest-file', 'x.json',
+        ]
+        result = self.runner.invoke(runner, args)
+        self.assertEqual(result.exit_code, 0)
+        self.assertTrue(os.path.exists('x.json.hashcache'))
+
+        with patch('s3_static_sync.static.get_md5_content') as fn:
+            result = self.runner.invoke(runner, args)
+            self.assertFalse(fn.called)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('file exist', result.output)
+
+        with patch('s3_static_sync.static.get_md5_content',
+                return_value='x') as fn:
+            result = self.runner.invoke(runner, args + ['--no-hash-cache'])
+            self.assertTrue(fn.called)
+        os.remove('x.json')
+
+    @mock_s3
+    def test_runner_previous_manifest(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+
+        args = [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--manifest-file', 'x.json',
+            '--previous-manifest', 'x.json',
+        ]
+        result = self.runner.invoke(runner, args)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('previous manifest x.json not found', result.output)
+        self.assertIn('file uploaded mock_local_folder/test.txt', result.output)
+
+        with patch('s3_static_sync.s3.list_objects_s3') as fn:
+            with patch('s3_static_sync.s3.check_key_exists') as fn2:
+                result = self.runner.invoke(runner, args)
+                self.assertFalse(fn.called)
+                self.assertFalse(fn2.called)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('file exist', result.output)
+
+        self.s3.Object(self.mock_bucket,
+            'mock_s3_folder/test-01a5f7b30cd86a9b2d70f80d2649ceac.txt').delete()
+        result = self.runner.invoke(runner, args + ['--verify-sample', '1'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('sampled keys of the previous manifest are missing',
+            result.output)
+        self.assertIn('file uploaded mock_local_folder/test.txt', result.output)
+        os.remove('x.json')
+
+    @mock_s3
+    def test_runner_async_engine(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+
+        args = [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--engine', 'async',
+            '--concurrency', '2',
+        ]
+        result = self.runner.invoke(runner, args)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('file uploaded mock_local_folder/test.txt', result.output)
+
+        result = self.runner.invoke(runner, args)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('file exist', result.output)
+
+    @mock_s3
+    def test_runner_metrics(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+
+        result = self.runner.invoke(runner, [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--metrics-file', 'metrics.json',
+        ])
+        self.assertEqual(result.exit_code, 0)
+        with open('metrics.json') as f:
+            report = json.loads(f.read())
+        os.remove('metrics.json')
+
+        for phase in ('list', 'scan', 'hash', 'upload'):
+            self.assertIn(phase, report['phases'])
+        self.assertEqual(report['counters']['bytes_sent'], 13)
+        self.assertEqual(report['requests']['PutObject']['count'], 1)
+        self.assertEqual(report['summary']['uploaded'], 1)
+
+    @mock_s3
+    def test_runner_multiple_targets(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+        self.s3.create_bucket(Bucket='mock-bucket-eu',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+        with open(self.test_file_path, 'w') as f:
+            f.write('Hello, World!' * 100)
+
+        args = [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--bucket', 'mock-bucket-eu',
+            '--bucket-region', 'eu-west-1',
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--gzip',
+            '--concurrency', '2',
+        ]
+        result = self.runner.invoke(runner, args)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('=> Resume s3://mock-bucket/mock_s3_folder\n',
+            result.output)
+        self.assertIn('=> Resume s3://mock-bucket-eu/mock_s3_folder\n',
+            result.output)
+
+        manifests = []
+        for name in ('mock-bucket', 'mock-bucket-eu'):
+            manifest_file = f'manifest.{name}.mock_s3_folder.json'
+            with open(manifest_file) as f:
+                manifests.append(json.loads(f.read()))
+            os.remove(manifest_file)
+        self.assertEqual(manifests[0], manifests[1])
+
+        s3_key = manifests[0]['mock_local_folder/test.txt']
+        for name in ('mock-bucket', 'mock-bucket-eu'):
+            obj = self.s3.Object(name, s3_key).get()
+            self.assertEqual(obj['ContentEncoding'], 'gzip')
+
+        result = self.runner.invoke(runner, args)
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.output.count('file exist'), 2)
+        for name in ('mock-bucket', 'mock-bucket-eu'):
+            os.remove(f'manifest.{name}.mock_s3_folder.json')
+
+    def test_runner_setup_error_closes_listings(self):
+        with open('broken.json', 'w') as f:
+            f.write('not\na manifest\n')
+        try:
+            with patch('s3_static_sync.index.ListingIndex') as listing_index:
+                result = self.runner.invoke(runner, [
+                    '--bucket', 'bucket-a',
+                    '--bucket', 'bucket-b',
+                    '--bucket-region', self.mock_region,
+                    '--local-folder', self.mock_local_folder,
+                    '--s3-folder', self.mock_s3_folder,
+                    '--previous-manifest', 'missing.json',
+                    '--previous-manifest', 'broken.json',
+                ])
+        finally:
+            os.remove('broken.json')
+        self.assertNotEqual(result.exit_code, 0)
+        # The first target was listing when the second one failed
+        self.assertEqual(listing_index.call_count, 1)
+        listing_index.return_value.close.assert_called_once_with()
+
+    def test_runner_multiple_targets_mismatch(self):
+        result = self.runner.invoke(runner, [
+            '--bucket', 'bucket-a',
+            '--bucket', 'bucket-b',
+            '--bucket', 'bucket-c',
+            '--bucket-region', 'us-east-1',
+            '--bucket-region', 'eu-west-1',
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+        ])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn('--bucket-region must be given once or once per target',
+            result.output)
+
+    @mock_s3
+    def test_runner_prune(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+
+        args = [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--keep-manifests', '1',
+            '--prune',
+            '--prune-min-age', '0',
+        ]
+        keys = []
+        for content in ('first', 'second', 'third'):
+            with open(self.test_file_path, 'w') as f:
+                f.write(content)
+            result = self.runner.invoke(runner, args)
+            self.assertEqual(result.exit_code, 0)
+            with open('manifest.json') as f:
+                keys.append(json.loads(f.read())['mock_local_folder/test.txt'])
+
+        self.assertIn('=> pruned 1 of 1 stale objects', result.output)
+        remote_keys = sorted(obj.key for obj in
+            self.s3.Bucket(self.mock_bucket).objects.all())
+        self.assertEqual(remote_keys, sorted(keys[1:]))
+        os.remove('manifest.json.1')
+
+    @mock_s3
+    def test_runner_watch(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+
+        def batches(watcher, debounce):
+            with open(self.test_file_path, 'w') as f:
+                f.write('changed')
+            yield watcher.resolve({self.test_file_path})
+            os.remove(self.test_file_path)
+            yield watcher.resolve({self.test_file_path})
+            raise KeyboardInterrupt
+
+        with patch('s3_static_sync.watch.batches', batches):
+            result = self.runner.invoke(runner, [
+                '--bucket', self.mock_bucket,
+                '--bucket-region', self.mock_region,
+                '--local-folder', self.mock_local_folder,
+                '--s3-folder', self.mock_s3_folder,
+                '--manifest-file', 'x.json',
+                '--watch',
+            ])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.output.count(
+            'file uploaded mock_local_folder/test.txt'), 2)
+        self.assertIn('=> synced 1 changed and 0 removed paths', result.output)
+        self.assertIn('=> synced 0 changed and 1 removed paths', result.output)
+        self.assertIn('=> stopped watching', result.output)
+        with open('x.json') as f:
+            self.assertEqual(json.loads(f.read()), {})
+        os.remove('x.json')
+        with open(self.test_file_path, 'w') as f:
+            f.write('Hello, World!')
+
+    @mock_s3
+    def test_runner_watch_changes_during_initial_sync(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+        sync_file = sync.sync_file
+
+        def rewriting_sync_file(ctx, entry):
+            # The build rewrites the file once it was scanned
+            results = list(sync_file(ctx, entry))
+            with open(entry.path, 'w') as f:
+                f.write('rewritten by the build')
+            return results
+
+        def batches(watcher, debounce):
+            yield watcher.resolve(watcher.poll(0.05))
+            raise KeyboardInterrupt
+
+        try:
+            with patch('s3_static_sync.watch.InotifyWatcher',
+                    side_effect=ImportError), \
+                    patch('s3_static_sync.sync.sync_file',
+                        rewriting_sync_file), \
+                    patch('s3_static_sync.watch.batches', batches):
+                result = self.runner.invoke(runner, [
+                    '--bucket', self.mock_bucket,
+                    '--bucket-region', self.mock_region,
+                    '--local-folder', self.mock_local_folder,
+                    '--s3-folder', self.mock_s3_folder,
+                    '--manifest-file', 'x.json',
+                    '--watch',
+                    '--watch-interval', '0.01',
+                ])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn('=> synced 1 changed and 0 removed paths',
+                result.output)
+        finally:
+            os.remove('x.json')
+            with open(self.test_file_path, 'w') as f:
+                f.write('Hello, World!')
+
+    @mock_s3
+    def test_runner_rules(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+        extra_file = os.path.join(self.mock_local_folder, 'app.js')
+        with open(extra_file, 'w') as f:
+            f.write('js')
+        with open('rules.json', 'w') as f:
+            f.write(json.dumps([{'pattern': '*.txt',
+                'cache_control': 'no-cache'}]))
+
+        args = [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--manifest-file', 'x.json',
+            '--header-cache-control', 'max-age=3600',
+            '--rules-file', 'rules.json',
+        ]
+        try:
+            result = self.runner.invoke(runner, args + ['-ea', '.txt',
+                '-ea', '.css'])
+            self.assertEqual(result.exit_code, 0)
+            with open('x.json') as f:
+                manifest = json.loads(f.read())
+            self.assertEqual(list(manifest), ['mock_local_folder/test.txt'])
+            obj = self.s3.Object(self.mock_bucket,
+                manifest['mock_local_folder/test.txt'])
+            self.assertEqual(obj.cache_control, 'no-cache')
+
+            result = self.runner.invoke(runner, args + ['--exclude',
+                '/test.txt'])
+            self.assertEqual(result.exit_code, 0)
+            with open('x.json') as f:
+                manifest = json.loads(f.read())
+            self.assertEqual(list(manifest), ['mock_local_folder/app.js'])
+            obj = self.s3.Object(self.mock_bucket,
+                manifest['mock_local_folder/app.js'])
+            self.assertEqual(obj.cache_control, 'max-age=3600')
+
+            result = self.runner.invoke(runner, args + ['--include',
+                're:(unclosed'])
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn('invalid pattern', result.output)
+        finally:
+            os.remove(extra_file)
+            os.remove('rules.json')
+            if os.path.exists('x.json'):
+                os.remove('x.json')
+
+    @mock_s3
+    def test_runner_manifest_format(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+
+        args = [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--manifest-file', 'x.jsonl',
+            '--previous-manifest', 'x.jsonl',
+        ]
+        result = self.runner.invoke(runner, args)
+        self.assertEqual(result.exit_code, 0)
+        with open('x.jsonl') as f:
+            self.assertEqual(json.loads(f.readline()),
+                ['mock_local_folder/test.txt',
+                'mock_s3_folder/test-01a5f7b30cd86a9b2d70f80d2649ceac.txt'])
+
+        # The JSON lines manifest is trusted by the next run
+        with patch('s3_static_sync.s3.check_key_exists') as fn:
+            result = self.runner.invoke(runner, args + ['--manifest-format',
+                'gzip'])
+            self.assertFalse(fn.called)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('file exist', result.output)
+        with open('x.jsonl', 'rb') as f:
+            self.assertEqual(f.read(2), b'\x1f\x8b')
+        os.remove('x.jsonl')
+        self.assertTrue(os.path.exists('x.jsonl.hashcache'))
+        os.remove('x.jsonl.hashcache')
+
+    @mock_s3
+    def test_runner_verify_objects(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+        args = [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--manifest-file', 'x.json',
+            '-ss', 'size',
+        ]
+        result = self.runner.invoke(runner, args)
+        self.assertEqual(result.exit_code, 0)
+        with open('x.json') as f:
+            s3_key = json.loads(f.read())['mock_local_folder/test.txt']
+
+        # An earlier upload of the same size that was cut or corrupted
+        self.s3.Object(self.mock_bucket, s3_key).put(Body=b'Hello, World?')
+        result = self.runner.invoke(runner, args)
+        self.assertIn('==> Skipped : 1', result.output)
+
+        result = self.runner.invoke(runner, args + ['--verify-objects'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('==> Uploaded: 1', result.output)
+        self.assertIn('=> 1 objects did not match', result.output)
+        self.assertEqual(self.s3.Object(self.mock_bucket, s3_key).get()[
+            'Body'].read(), b'Hello, World!')
+
+        result = self.runner.invoke(runner, args + ['--verify-objects'])
+        self.assertIn('==> Skipped : 1', result.output)
+        self.assertIn('=> 0 objects did not match', result.output)
+        os.remove('x.json')
+
+    @mock_s3
+    def test_runner_verify_objects_gzip(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+        large_file = os.path.join(self.mock_local_folder, 'large.txt')
+        with open(large_file, 'wb') as f:
+            f.write(os.urandom(3 * 1024 * 1024).hex().encode())
+        args = [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--manifest-file', 'x.json',
+            '--multipart-threshold', str(5 * 1024 * 1024),
+            '--multipart-chunksize', str(5 * 1024 * 1024),
+            '--verify-objects',
+        ]
+        try:
+            # Multipart ETags, then gzipped and streamed gzipped bodies
+            for extra in ([], ['--gzip']):
+                result = self.runner.invoke(runner, args + extra)
+                self.assertEqual(result.exit_code, 0)
+                self.assertIn('==> Uploaded: 2', result.output)
+                result = self.runner.invoke(runner, args + extra)
+                self.assertIn('==> Skipped : 2', result.output)
+                self.assertIn('=> 0 objects did not match', result.output)
+        finally:
+            os.remove(large_file)
+            os.remove('x.json')
+            os.remove('x.json.hashcache')
+
+    def test_runner_verify_objects_head(self):
+        result = self.runner.invoke(runner, [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--lookup-mode', 'head',
+            '--verify-objects',
+        ])
+        self.assertEqual(result.exit_code, 2)
+
+    def test_runner_verify_objects_previous_manifest(self):
+        result = self.runner.invoke(runner, [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--previous-manifest', 'previous.json',
+            '--verify-objects',
+        ])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn('--previous-manifest', result.output)
+
+    @mock_s3
+    def test_runner_schedule(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+        extra_files = {'a.css': 50, 'big.js': 5000, 'index.html': 9000}
+        for name, size in extra_files.items():
+            with open(os.path.join(self.mock_local_folder, name), 'w') as f:
+                f.write('x' * size)
+
+        def uploaded(output):
+            return [line.rsplit('/', 1)[-1] for line in output.splitlines()
+                if line.startswith('=> file uploaded')]
+
+        try:
+            result = self.runner.invoke(runner, [
+                '--bucket', self.mock_bucket,
+                '--bucket-region', self.mock_region,
+                '--local-folder', self.mock_local_folder,
+                '--s3-folder', self.mock_s3_folder,
+                '--manifest-file', 'x.json',
+                '--schedule', 'largest-first',
+                '--upload-last', '*.html',
+            ])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(uploaded(result.output),
+                ['big.js', 'a.css', 'test.txt', 'index.html'])
+
+            # Results come back as files complete with concurrency
+            for name in extra_files:
+                with open(os.path.join(self.mock_local_folder, name),
+                        'a') as f:
+                    f.write('y')
+            result = self.runner.invoke(runner, [
+                '--bucket', self.mock_bucket,
+                '--bucket-region', self.mock_region,
+                '--local-folder', self.mock_local_folder,
+                '--s3-folder', self.mock_s3_folder,
+                '--manifest-file', 'x.json',
+                '--schedule', 'largest-first',
+                '--upload-last', '*.html',
+                '--concurrency', '4',
+            ])
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(sorted(uploaded(result.output)[:2]),
+                ['a.css', 'big.js'])
+            self.assertEqual(uploaded(result.output)[-1], 'index.html')
+            with open('x.json') as f:
+                self.assertEqual(len(json.loads(f.read())), 4)
+        finally:
+            for name in extra_files:
+                os.remove(os.path.join(self.mock_local_folder, name))
+            os.remove('x.json')
+            os.remove('x.json.hashcache')
+
+    @mock_s3
+    def test_runner_schedule_prefix_lookups(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+        sub_folder = os.path.join(self.mock_local_folder, 'sub')
+        os.makedirs(sub_folder, exist_ok=True)
+        extra_files = {'a.css': 50, 'big.js': 5000, 'sub/c.js': 3000,
+            'sub/d.js': 10}
+        for name, size in extra_files.items():
+            with open(os.path.join(self.mock_local_folder, name), 'w') as f:
+                f.write('x' * size)
+
+        try:
+            result = self.runner.invoke(runner, [
+                '--bucket', self.mock_bucket,
+                '--bucket-region', self.mock_region,
+                '--local-folder', self.mock_local_folder,
+                '--s3-folder', self.mock_s3_folder,
+                '--manifest-file', 'x.json',
+                '--schedule', 'largest-first',
+                '--lookup-mode', 'prefix',
+            ])
+            self.assertEqual(result.exit_code, 0)
+            # Folders by their largest file, each folder by size
+            self.assertEqual([line.split('mock_local_folder/', 1)[1]
+                for line in result.output.splitlines()
+                if line.startswith('=> file uploaded')],
+                ['big.js', 'a.css', 'test.txt', 'sub/c.js', 'sub/d.js'])
+        finally:
+            for name in extra_files:
+                os.remove(os.path.join(self.mock_local_folder, name))
+            os.rmdir(sub_folder)
+            os.remove('x.json')
+            os.remove('x.json.hashcache')
+
+    @mock_s3
+    def test_runner_resume_journal(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+        extra_files = [os.path.join(self.mock_local_folder, name)
+            for name in ('a.css', 'b.css')]
+        for i, file_path in enumerate(extra_files):
+            with open(file_path, 'w') as f:
+                f.write(f'body {{ margin: {i} }}')
+        args = [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--manifest-file', 'x.json',
+            '--lookup-mode', 'head',
+            '--journal-fsync-every', '1',
+        ]
+        upload = sync._upload
+        calls = []
+
+        def killed_upload(*args, **kwargs):
+            calls.append(args)
+            if len(calls) > 1:
+                raise RuntimeError('killed')
+            return upload(*args, **kwargs)
+
+        try:
+            with patch('s3_static_sync.sync._upload', killed_upload):
+                result = self.runner.invoke(runner, args)
+            self.assertNotEqual(result.exit_code, 0)
+            self.assertFalse(os.path.exists('x.json'))
+            self.assertTrue(os.path.exists('x.json.journal'))
+
+            with patch('s3_static_sync.s3.check_key_exists',
+                    wraps=s3.check_key_exists) as fn:
+                result = self.runner.invoke(runner, args)
+                # The file of the first run is replayed without a request
+                self.assertEqual(fn.call_count, 2)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn('=> resuming an interrupted run, 1 files',
+                result.output)
+            self.assertIn('==> Uploaded: 2', result.output)
+            self.assertIn('==> Skipped : 1', result.output)
+            self.assertFalse(os.path.exists('x.json.journal'))
+            with open('x.json') as f:
+                self.assertEqual(len(json.loads(f.read())), 3)
+        finally:
+            for file_path in extra_files:
+                os.remove(file_path)
+            for name in ('x.json', 'x.json.hashcache', 'x.json.tmp',
+                    'x.json.journal'):
+                if os.path.exists(name):
+                    os.remove(name)
+
+    @mock_s3
+    def test_runner_dedup(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+        content = 'Hello, World! ' * 100
+        extra_files = [os.path.join(self.mock_local_folder, name)
+            for name in ('a.css', 'b.css', 'c.txt')]
+        for file_path in extra_files:
+            with open(file_path, 'w') as f:
+                f.write(content)
+
+        try:
+            with patch('s3_static_sync.s3.gzip_content',
+                    wraps=s3.gzip_content) as fn:
+                result = self.runner.invoke(runner, [
+                    '--bucket', self.mock_bucket,
+                    '--bucket-region', self.mock_region,
+                    '--local-folder', self.mock_local_folder,
+                    '--s3-folder', self.mock_s3_folder,
+                    '--manifest-file', 'x.json',
+                    '--gzip',
+                    '--dedup',
+                ])
+                # The duplicates of a.css are neither compressed nor sent
+                self.assertEqual(fn.call_count, 2)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn('==> Uploaded: 2', result.output)
+            self.assertIn('==> Copied  : 2', result.output)
+            self.assertIn('=> deduplication saved', result.output)
+
+            with open('x.json') as f:
+                manifest = json.loads(f.read())
+            for name, content_type in (('b.css', 'text/css'),
+                    ('c.txt', 'text/plain')):
+                obj = self.s3.Object(self.mock_bucket,
+                    manifest[f'mock_local_folder/{name}'])
+                self.assertEqual(obj.content_type, content_type)
+                self.assertEqual(obj.content_encoding, 'gzip')
+                self.assertEqual(gzip.decompress(obj.get()['Body'].read()),
+                    content.encode())
+            os.remove('x.json')
+        finally:
+            for file_path in extra_files:
+                os.remove(file_path)
+
+    def test_runner_dedup_requires_content(self):
+        result = self.runner.invoke(runner, [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '-ss', 'size',
+            '--dedup',
+        ])
+        self.assertEqual(result.exit_code, 2)
+
     @mock_s3
     def test_runner_dry_run(self):
         # Setup mock S3
@@ -147,7 +896,41 @@ class TestRunnerCommand(unittest.TestCase):
         ])
         self.assertEqual(result.exit_code, 0)
 
+    def test_lazy_imports(self):
+        code = ('import sys, s3_static_sync.app; '
+            'print(sorted(name for name in ("asyncio", "boto3", "sqlite3") '
+            'if name in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.decode().strip(), '[]')
+
+    @mock_s3
+    def test_runner_dry_run_without_client(self):
+        self.s3 = boto3.resource('s3', region_name=self.mock_region)
+        self.s3.create_bucket(Bucket=self.mock_bucket)
+
+        args = [
+            '--bucket', self.mock_bucket,
+            '--bucket-region', self.mock_region,
+            '--local-folder', self.mock_local_folder,
+            '--s3-folder', self.mock_s3_folder,
+            '--manifest-file', 'x.json',
+            '--previous-manifest', 'x.json',
+        ]
+        result = self.runner.invoke(runner, args)
+        self.assertEqual(result.exit_code, 0)
+
+        # Every file is covered by the previous manifest, S3 is never reached
+        with patch('s3_static_sync.s3.get_client') as fn:
+            result = self.runner.invoke(runner, args + ['--dry-run'])
+            self.assertFalse(fn.called)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('file exist', result.output)
+        os.remove('x.json')
+
     def tearDown(self):
+        for cache_path in ('manifest.json.hashcache', 'x.json.hashcache'):
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
         os.remove(self.test_file_path)
         if os.path.exists(self.mock_local_folder):
             os.rmdir(self.mock_local_folder)
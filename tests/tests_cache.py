@@ -0,0 +1,73 @@
+import os
+import unittest
+from unittest.mock import patch
+
+from s3_static_sync.cache import HashCache
+
+
+class TestHashCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_path = 'test.hashcache'
+        self.test_file_name = 'test.txt'
+        with open(self.test_file_name, 'w') as f:
+            f.write('Hello, World!')
+        # Move the mtime out of the racy window so the entry gets cached
+        os.utime(self.test_file_name, (1000000000, 1000000000))
+
+    def test_reuse_digest(self):
+        hash_cache = HashCache(self.cache_path)
+        md5 = hash_cache.get_md5('test.txt', self.test_file_name)
+        self.assertEqual(md5, '65a8e27d8879283831b664bd8b7f0ad4')
+        hash_cache.save()
+
+        hash_cache = HashCache(self.cache_path)
+        with patch('s3_static_sync.static.get_md5_content') as fn:
+            self.assertEqual(hash_cache.get_md5('test.txt', self.test_file_name),
+                md5)
+            self.assertFalse(fn.called)
+
+    def test_invalidate_modified_file(self):
+        hash_cache = HashCache(self.cache_path)
+        hash_cache.get_md5('test.txt', self.test_file_name)
+        hash_cache.save()
+
+        with open(self.test_file_name, 'w') as f:
+            f.write('Hello, World?')
+        os.utime(self.test_file_name, (1000000001, 1000000001))
+
+        hash_cache = HashCache(self.cache_path)
+        self.assertIsNone(hash_cache.get('test.txt',
+            os.stat(self.test_file_name)))
+
+    def test_skip_racy_file(self):
+        os.utime(self.test_file_name)
+        hash_cache = HashCache(self.cache_path)
+        hash_cache.get_md5('test.txt', self.test_file_name)
+        hash_cache.save()
+
+        hash_cache = HashCache(self.cache_path)
+        self.assertIsNone(hash_cache.get('test.txt',
+            os.stat(self.test_file_name)))
+
+    def test_drop_unseen_entries(self):
+        hash_cache = HashCache(self.cache_path)
+        hash_cache.get_md5('test.txt', self.test_file_name)
+        hash_cache.save()
+
+        HashCache(self.cache_path).save()
+        hash_cache = HashCache(self.cache_path)
+        self.assertIsNone(hash_cache.get('test.txt',
+            os.stat(self.test_file_name)))
+
+    def test_corrupt_cache(self):
+        with open(self.cache_path, 'w') as f:
+            f.write('not a database')
+        hash_cache = HashCache(self.cache_path)
+        self.assertIsNone(hash_cache.get('test.txt',
+            os.stat(self.test_file_name)))
+        hash_cache.save()
+
+    def tearDown(self):
+        os.remove(self.test_file_name)
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
@@ -0,0 +1,48 @@
+import gzip
+import importlib.util
+import unittest
+
+from s3_static_sync.compress import Compressor
+
+HAS_BROTLI = importlib.util.find_spec('brotli') is not None
+
+
+class TestCompressor(unittest.TestCase):
+    def test_is_compressible(self):
+        compressor = Compressor()
+        self.assertTrue(compressor.is_compressible('app.js'))
+        self.assertTrue(compressor.is_compressible('logo.svg'))
+        self.assertFalse(compressor.is_compressible('logo.png'))
+        self.assertFalse(compressor.is_compressible('font.woff2'))
+        self.assertFalse(compressor.is_compressible('movie.mp4'))
+
+    def test_gzip(self):
+        content = b'Hello, World!' * 100
+        compressed = Compressor(level=1).gzip(content)
+        self.assertEqual(gzip.decompress(compressed), content)
+
+    def test_gzip_min_savings(self):
+        self.assertIsNone(Compressor().gzip(b'Hello, World!'))
+
+        content = b'Hello, World!' * 100
+        self.assertIsNotNone(Compressor(min_savings=0.5).gzip(content))
+        self.assertIsNone(Compressor(min_savings=0.99).gzip(content))
+
+    def test_gzip_workers(self):
+        content = b'Hello, World!' * 100
+        compressor = Compressor(workers=2)
+        try:
+            self.assertEqual(gzip.decompress(compressor.gzip(content)),
+                content)
+            # Never forked from the threads of the run
+            self.assertNotEqual(
+                compressor._executor._mp_context.get_start_method(), 'fork')
+        finally:
+            compressor.close()
+
+    @unittest.skipUnless(HAS_BROTLI, 'brotli is not installed')
+    def test_brotli_variant(self):
+        import brotli
+        content = b'Hello, World!' * 100
+        compressed = Compressor(brotli=True).brotli_variant(content)
+        self.assertEqual(brotli.decompress(compressed), content)
@@ -0,0 +1,41 @@
+import threading
+import unittest
+
+from s3_static_sync.dedup import Deduplicator
+
+
+class TestDeduplicator(unittest.TestCase):
+    def test_claim(self):
+        dedup = Deduplicator()
+        self.assertEqual(dedup.claim('bucket', ('md5', True)), (True, None))
+        # Other buckets and encodings are separate blobs
+        self.assertEqual(dedup.claim('other', ('md5', True)), (True, None))
+        self.assertEqual(dedup.claim('bucket', ('md5', False)), (True, None))
+
+        dedup.done('bucket', ('md5', True), 'folder/a-1.js',
+            content_encoding='gzip', size=10)
+        owner, source = dedup.claim('bucket', ('md5', True))
+        self.assertFalse(owner)
+        self.assertEqual((source.s3_key, source.content_encoding,
+            source.has_brotli, source.size),
+            ('folder/a-1.js', 'gzip', False, 10))
+
+    def test_failed_owner(self):
+        dedup = Deduplicator()
+        dedup.claim('bucket', 'md5')
+        dedup.done('bucket', 'md5')
+        self.assertEqual(dedup.claim('bucket', 'md5'), (False, None))
+
+    def test_wait_for_owner(self):
+        dedup = Deduplicator()
+        dedup.claim('bucket', 'md5')
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(
+            dedup.claim('bucket', 'md5')))
+        waiter.start()
+        waiter.join(0.05)
+        self.assertTrue(waiter.is_alive())
+
+        dedup.done('bucket', 'md5', 'folder/a-1.js')
+        waiter.join()
+        self.assertEqual(results[0][1].s3_key, 'folder/a-1.js')
@@ -0,0 +1,198 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+import tracemalloc
+import unittest
+from unittest.mock import patch
+
+from moto import mock_s3
+
+from s3_static_sync.index import (ListingIndex, PrefixIndex, RemoteIndex,
+    load_remote_index)
+from s3_static_sync.s3 import get_client
+
+
+class TestRemoteIndex(unittest.TestCase):
+    def test_add_and_lookup(self):
+        remote_index = RemoteIndex('folder')
+        remote_index.add('folder/a.txt', '"9a0364b9e99bb480dd25e1f0284c8555"', 7)
+        remote_index.add('folder/b.txt', '"d41d8cd98f00b204e9800998ecf8427e-3"', 42)
+
+        self.assertIn('folder/a.txt', remote_index)
+        self.assertNotIn('folder/c.txt', remote_index)
+        self.assertNotIn('other/a.txt', remote_index)
+        self.assertEqual(len(remote_index), 2)
+        self.assertEqual(remote_index.get('folder/a.txt'),
+            ('9a0364b9e99bb480dd25e1f0284c8555', 7))
+        self.assertEqual(remote_index.get('folder/b.txt'),
+            ('d41d8cd98f00b204e9800998ecf8427e-3', 42))
+        self.assertIsNone(remote_index.get('folder/c.txt'))
+        self.assertEqual(sorted(remote_index), ['folder/a.txt', 'folder/b.txt'])
+
+    def test_growth(self):
+        remote_index = RemoteIndex('folder/')
+        for i in range(100):
+            remote_index.add(f'folder/{i:02}.txt', None, i)
+        remote_index.add('folder/05.txt', '"9a0364b9e99bb480dd25e1f0284c8555-2"', 50)
+        remote_index.add('folder/07.txt', '"kms-etag"', 70)
+
+        self.assertEqual(remote_index.get('folder/04.txt'), (None, 4))
+        self.assertEqual(remote_index.get('folder/05.txt'),
+            ('9a0364b9e99bb480dd25e1f0284c8555-2', 50))
+        self.assertEqual(remote_index.get('folder/07.txt'), ('kms-etag', 70))
+        self.assertNotIn('folder/100.txt', remote_index)
+        self.assertEqual(len(remote_index), 100)
+        self.assertEqual(list(remote_index),
+            [f'folder/{i:02}.txt' for i in range(100)])
+        self.assertEqual(remote_index.get('folder/99.txt'), (None, 99))
+
+    def test_footprint(self):
+        # Keys, ETags and sizes take less memory than a list of the keys,
+        # while the index is built too
+        prefix = 'website/assets/'
+        keys = [f'{prefix}js/chunk-{i}-{i * 7919:016x}.js' for i in range(20000)]
+        etags = [f'"{i:032x}"' for i in range(len(keys))]
+
+        tracemalloc.start()
+        try:
+            key_list = [''.join(key) for key in keys]
+            list_size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        del key_list
+
+        tracemalloc.start()
+        try:
+            remote_index = RemoteIndex(prefix)
+            for key, etag in zip(keys, etags):
+                remote_index.add(key, etag, 1024)
+            index_size, index_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(len(remote_index), len(keys))
+        self.assertLess(index_size, list_size)
+        self.assertLess(index_peak, list_size)
+
+    def test_add_outside_prefix(self):
+        remote_index = RemoteIndex('folder')
+        with self.assertRaises(ValueError):
+            remote_index.add('other/a.txt')
+
+    @mock_s3
+    def test_load_remote_index(self):
+        client = get_client('us-east-1')
+        client.create_bucket(Bucket='test-bucket')
+        client.put_object(Bucket='test-bucket', Key='folder/test.txt',
+            Body='content')
+
+        remote_index = load_remote_index(client, 'test-bucket', 'folder')
+        self.assertIn('folder/test.txt', remote_index)
+        head = client.head_object(Bucket='test-bucket', Key='folder/test.txt')
+        self.assertEqual(remote_index.get('folder/test.txt'),
+            (head['ETag'].strip('"'), head['ContentLength']))
+
+    @mock_s3
+    def test_prefix_index(self):
+        client = get_client('us-east-1')
+        client.create_bucket(Bucket='test-bucket')
+        for key in ('folder/a/1.txt', 'folder/a/sub/2.txt', 'folder/b/3.txt'):
+            client.put_object(Bucket='test-bucket', Key=key, Body='content')
+
+        prefix_index = PrefixIndex(client, 'test-bucket', max_folders=1)
+        with patch.object(client, 'list_objects_v2',
+                wraps=client.list_objects_v2) as fn:
+            self.assertIn('folder/a/1.txt', prefix_index)
+            self.assertNotIn('folder/a/2.txt', prefix_index)
+            self.assertIsNotNone(prefix_index.get('folder/a/1.txt'))
+            self.assertEqual(fn.call_count, 1)
+
+            self.assertIn('folder/a/sub/2.txt', prefix_index)
+            self.assertIn('folder/b/3.txt', prefix_index)
+            self.assertEqual(fn.call_count, 3)
+
+            # Only the last folder is kept
+            self.assertIn('folder/a/1.txt', prefix_index)
+            self.assertEqual(fn.call_count, 4)
+
+    @mock_s3
+    def test_prefix_index_concurrent_misses(self):
+        client = get_client('us-east-1')
+        client.create_bucket(Bucket='test-bucket')
+        for key in ('folder/a/1.txt', 'folder/b/2.txt'):
+            client.put_object(Bucket='test-bucket', Key=key, Body='content')
+        list_objects_v2 = client.list_objects_v2
+
+        def slow_list(**kwargs):
+            time.sleep(0.05)
+            return list_objects_v2(**kwargs)
+
+        prefix_index = PrefixIndex(client, 'test-bucket')
+        keys = ['folder/a/1.txt', 'folder/b/2.txt'] * 8
+        with patch.object(client, 'list_objects_v2',
+                side_effect=slow_list) as fn:
+            with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+                found = list(executor.map(prefix_index.__contains__, keys))
+        self.assertTrue(all(found))
+        # One listing per folder, the other threads wait for it
+        self.assertEqual(fn.call_count, 2)
+
+    @mock_s3
+    def test_listing_index(self):
+        client = get_client('us-east-1')
+        client.create_bucket(Bucket='test-bucket')
+        keys = ['folder/index.html', 'folder/a/sub/1.txt', 'folder2/b.txt']
+        keys += [f'folder/big/{name}-{i}.js' for name in ('app', 'lib', 'x')
+            for i in range(5)]
+        for key in keys:
+            client.put_object(Bucket='test-bucket', Key=key, Body='content')
+        list_objects_v2 = client.list_objects_v2
+
+        with patch.object(client, 'list_objects_v2', side_effect=lambda
+                **kwargs: list_objects_v2(MaxKeys=2, **kwargs)):
+            listing = ListingIndex(client, 'test-bucket', 'folder',
+                workers=4)
+            for key in keys:
+                self.assertIn(key, listing)
+            self.assertNotIn('folder/a/2.txt', listing)
+            self.assertNotIn('folder/missing/1.txt', listing)
+            self.assertNotIn('other/1.txt', listing)
+            listing.wait()
+            listing.close()
+
+        self.assertEqual(len(listing.remote_index), len(keys))
+        head = client.head_object(Bucket='test-bucket', Key=keys[0])
+        self.assertEqual(listing.get(keys[0]),
+            (head['ETag'].strip('"'), head['ContentLength']))
+
+    @mock_s3
+    def test_listing_index_split(self):
+        client = get_client('us-east-1')
+        client.create_bucket(Bucket='test-bucket')
+        keys = [f'folder/{name}-{i}.js' for name in ('app', 'lib', 'main',
+            'vendor') for i in range(3)]
+        for key in keys:
+            client.put_object(Bucket='test-bucket', Key=key, Body='content')
+        list_objects_v2 = client.list_objects_v2
+
+        # The first page holds a single folder, the rest of it is split by
+        # the first character of the names
+        with patch.object(client, 'list_objects_v2', side_effect=lambda
+                **kwargs: list_objects_v2(MaxKeys=2, **kwargs)) as fn:
+            listing = ListingIndex(client, 'test-bucket', 'folder/',
+                workers=4)
+            listing.wait()
+            listing.close()
+
+        self.assertEqual(sorted(listing.remote_index), sorted(keys))
+        start_after = [call.kwargs['StartAfter']
+            for call in fn.call_args_list if 'StartAfter' in call.kwargs]
+        self.assertTrue(start_after)
+        self.assertTrue(all(key.startswith('folder/') for key in start_after))
+
+    @mock_s3
+    def test_listing_index_error(self):
+        client = get_client('us-east-1')
+        listing = ListingIndex(client, 'missing-bucket', 'folder')
+        with self.assertRaises(Exception):
+            'folder/a.txt' in listing
+        listing.close()
@@ -0,0 +1,60 @@
+import os
+import unittest
+
+from s3_static_sync.journal import Journal, load_journal
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.path = 'test.journal'
+
+    def test_resume(self):
+        self.assertEqual(load_journal(self.path, 'bucket'), {})
+        journal = Journal(self.path, 'bucket', fsync_every=1)
+        journal.add('site/a.js', 'folder/site/a-1.js')
+        journal.close()
+
+        # A second interrupted attempt appends to the first one
+        journal = Journal(self.path, 'bucket')
+        journal.add('site/b.js', 'folder/site/b-1.js')
+        journal.close()
+        self.assertEqual(load_journal(self.path, 'bucket'), {
+            'site/a.js': 'folder/site/a-1.js',
+            'site/b.js': 'folder/site/b-1.js',
+        })
+        self.assertEqual(load_journal(self.path, 'other-bucket'), {})
+
+        journal = Journal(self.path, 'bucket')
+        journal.remove()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_torn_line(self):
+        journal = Journal(self.path, 'bucket')
+        journal.add('site/a.js', 'folder/site/a-1.js')
+        journal.close()
+        with open(self.path, 'a') as f:
+            f.write('["site/b.js", "fold')
+
+        self.assertEqual(load_journal(self.path, 'bucket'),
+            {'site/a.js': 'folder/site/a-1.js'})
+        journal = Journal(self.path, 'bucket')
+        journal.add('site/c.js', 'folder/site/c-1.js')
+        journal.close()
+        self.assertEqual(load_journal(self.path, 'bucket'), {
+            'site/a.js': 'folder/site/a-1.js',
+            'site/c.js': 'folder/site/c-1.js',
+        })
+
+    def test_other_bucket(self):
+        journal = Journal(self.path, 'bucket')
+        journal.add('site/a.js', 'folder/site/a-1.js')
+        journal.close()
+
+        # The journal of another bucket is started over
+        Journal(self.path, 'other-bucket').close()
+        self.assertEqual(load_journal(self.path, 'bucket'), {})
+        self.assertEqual(load_journal(self.path, 'other-bucket'), {})
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,89 @@
+import json
+import os
+import unittest
+
+from s3_static_sync.manifest import (ManifestWriter, infer_format,
+    load_manifest, write_manifest)
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.manifest_file = 'test_manifest.json'
+        self.manifest = {
+            'site/index.html': 'folder/index-1.html',
+            'site/café "menu".txt': 'folder/café "menu"-2.txt',
+        }
+
+    def test_formats(self):
+        for manifest_format in ('json', 'min', 'jsonl', 'gzip'):
+            for manifest in (self.manifest, {}):
+                write_manifest(self.manifest_file, manifest, manifest_format)
+                self.assertEqual(load_manifest(self.manifest_file), manifest)
+        self.assertFalse(os.path.exists(f'{self.manifest_file}.tmp'))
+
+    def test_same_output_as_json_dumps(self):
+        for manifest in (self.manifest, {}):
+            write_manifest(self.manifest_file, manifest, 'json')
+            with open(self.manifest_file) as f:
+                self.assertEqual(f.read(), json.dumps(manifest, indent=2))
+
+            write_manifest(self.manifest_file, manifest, 'min')
+            with open(self.manifest_file) as f:
+                self.assertEqual(f.read(), json.dumps(manifest,
+                    separators=(',', ':')))
+
+    def test_jsonl(self):
+        write_manifest(self.manifest_file, {'a.js': 'k-1.js'}, 'jsonl')
+        with open(self.manifest_file) as f:
+            self.assertEqual(f.read(), '["a.js","k-1.js"]\n')
+
+    def test_abort_keeps_previous_manifest(self):
+        write_manifest(self.manifest_file, self.manifest)
+        writer = ManifestWriter(self.manifest_file, 'jsonl', flush_every=1)
+        writer.add('site/new.js', 'folder/new-3.js')
+        writer.abort()
+
+        self.assertEqual(load_manifest(self.manifest_file), self.manifest)
+        self.assertEqual(load_manifest(f'{self.manifest_file}.tmp'),
+            {'site/new.js': 'folder/new-3.js'})
+
+    def test_abort_terminates_temp_file(self):
+        for manifest_format in ('json', 'min', 'jsonl', 'gzip'):
+            writer = ManifestWriter(self.manifest_file, manifest_format)
+            for manifest_path, s3_key in self.manifest.items():
+                writer.add(manifest_path, s3_key)
+            writer.abort()
+            self.assertEqual(load_manifest(f'{self.manifest_file}.tmp'),
+                self.manifest)
+
+    def test_load_truncated_temp_file(self):
+        # What a killed run leaves, cut anywhere
+        entries = dict(self.manifest, **{'site/a,b.js': 'folder/a,b-3.js'})
+        for manifest_format in ('json', 'min', 'jsonl'):
+            write_manifest(self.manifest_file, entries, manifest_format)
+            with open(self.manifest_file, encoding='utf-8') as f:
+                text = f.read()
+            for end in range(len(text)):
+                with open(self.manifest_file, 'w', encoding='utf-8') as f:
+                    f.write(text[:end])
+                manifest = load_manifest(self.manifest_file)
+                self.assertLessEqual(manifest.items(), entries.items())
+
+        writer = ManifestWriter(self.manifest_file, 'gzip', flush_every=1)
+        try:
+            for manifest_path, s3_key in self.manifest.items():
+                writer.add(manifest_path, s3_key)
+            self.assertEqual(load_manifest(f'{self.manifest_file}.tmp'),
+                self.manifest)
+        finally:
+            writer.abort()
+
+    def test_infer_format(self):
+        self.assertEqual(infer_format('manifest.json'), 'json')
+        self.assertEqual(infer_format('manifest.jsonl'), 'jsonl')
+        self.assertEqual(infer_format('manifest.json.gz'), 'gzip')
+
+    def tearDown(self):
+        for path in (self.manifest_file, f'{self.manifest_file}.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,66 @@
+import json
+import os
+import unittest
+
+from moto import mock_s3
+
+from s3_static_sync.metrics import Histogram, Metrics, write_report
+from s3_static_sync.s3 import get_client
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram(buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.7, 5):
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(list(histogram.cumulative()),
+            [(0.1, 1), (1, 3), ('+Inf', 4)])
+
+    def test_phase_and_counters(self):
+        metrics = Metrics()
+        with metrics.phase('hash'):
+            pass
+        metrics.increment('bytes_sent', 10)
+        metrics.increment('bytes_sent', 5)
+        self.assertEqual(list(metrics.timed_iter([1, 2], 'scan')), [1, 2])
+
+        report = metrics.report(dict(total=2))
+        self.assertIn('hash', report['phases'])
+        self.assertIn('scan', report['phases'])
+        self.assertEqual(report['counters'], dict(bytes_sent=15))
+        self.assertEqual(report['summary'], dict(total=2))
+
+    @mock_s3
+    def test_instrument_client(self):
+        metrics = Metrics()
+        client = get_client('us-east-1')
+        metrics.instrument_client(client)
+        client.create_bucket(Bucket='test-bucket')
+        client.put_object(Bucket='test-bucket', Key='test.txt', Body='content')
+
+        report = metrics.report()
+        self.assertEqual(report['requests']['PutObject']['count'], 1)
+        self.assertEqual(report['requests']['PutObject']['buckets']['+Inf'], 1)
+
+        metrics.release_client(client)
+        client.put_object(Bucket='test-bucket', Key='test.txt', Body='content')
+        self.assertEqual(metrics.report()['requests']['PutObject']['count'], 1)
+
+        prometheus = metrics.to_prometheus()
+        self.assertIn('s3_static_sync_request_seconds_count'
+            '{operation="PutObject"} 1', prometheus)
+
+    def test_write_report(self):
+        metrics = Metrics()
+        write_report(metrics, dict(uploaded=1), 'metrics.json', 'metrics.prom')
+        try:
+            with open('metrics.json') as f:
+                self.assertEqual(json.loads(f.read())['summary'],
+                    dict(uploaded=1))
+            with open('metrics.prom') as f:
+                self.assertIn('s3_static_sync_files{status="uploaded"} 1',
+                    f.read())
+        finally:
+            os.remove('metrics.json')
+            os.remove('metrics.prom')
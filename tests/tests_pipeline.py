@@ -0,0 +1,62 @@
+import os
+import shutil
+import unittest
+
+from moto import mock_s3
+
+from s3_static_sync import pipeline, static, sync
+from s3_static_sync.index import load_remote_index
+from s3_static_sync.s3 import get_client
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.bucket = 'test-bucket'
+        self.folder_path = 'test_pipeline'
+        os.makedirs(os.path.join(self.folder_path, 'sub'), exist_ok=True)
+        for i in range(20):
+            with open(os.path.join(self.folder_path, 'sub', f'{i}.txt'), 'w') as f:
+                f.write(f'content {i}')
+
+    def _context(self, client, remote_index=None, **kwargs):
+        target = sync.Target(client, self.bucket, 'folder',
+            remote_index=remote_index)
+        return sync.SyncContext(self.folder_path, 'private', ['content'],
+            [target], **kwargs)
+
+    def _run(self, ctx, concurrency=4):
+        results = []
+        entries = static.scan_entries(self.folder_path)
+        pipeline.run(ctx, entries, concurrency, results.append)
+        return results
+
+    @mock_s3
+    def test_run(self):
+        client = get_client('us-east-1')
+        client.create_bucket(Bucket=self.bucket)
+
+        results = self._run(self._context(client))
+        self.assertEqual(len(results), 20)
+        self.assertEqual({result.status for result in results}, {sync.UPLOADED})
+
+        remote_index = load_remote_index(client, self.bucket, 'folder')
+        self.assertEqual(sorted(remote_index),
+            sorted(result.s3_key for result in results))
+
+        results = self._run(self._context(client, remote_index=remote_index))
+        self.assertEqual({result.status for result in results}, {sync.SKIPPED})
+
+    @mock_s3
+    def test_run_error_in_callback(self):
+        client = get_client('us-east-1')
+        client.create_bucket(Bucket=self.bucket)
+
+        def on_result(result):
+            raise RuntimeError('stop')
+
+        with self.assertRaises(RuntimeError):
+            pipeline.run(self._context(client, dry_run=True),
+                static.scan_entries(self.folder_path), 2, on_result)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_path)
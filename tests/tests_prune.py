@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import unittest
+
+from moto import mock_s3
+
+from s3_static_sync import prune
+from s3_static_sync.s3 import delete_keys, get_client, list_folder_s3
+
+
+class TestPrune(unittest.TestCase):
+    def setUp(self):
+        self.bucket = 'test-bucket'
+        self.manifest_file = 'test_prune.json'
+
+    def _mock_client(self, keys):
+        client = get_client('us-east-1')
+        client.create_bucket(Bucket=self.bucket)
+        for key in keys:
+            client.put_object(Bucket=self.bucket, Key=key, Body=b'x')
+        return client
+
+    def test_rotate_manifests(self):
+        for i in range(4):
+            with open(self.manifest_file, 'w') as f:
+                f.write(json.dumps({'run': i}))
+            prune.rotate_manifests(self.manifest_file, 2)
+
+        history = prune.manifest_history(self.manifest_file, 3)
+        self.assertEqual(history, ['test_prune.json.1', 'test_prune.json.2',
+            'test_prune.json.3'])
+        with open(history[0]) as f:
+            self.assertEqual(json.loads(f.read()), {'run': 3})
+        with open(history[1]) as f:
+            self.assertEqual(json.loads(f.read()), {'run': 2})
+        self.assertFalse(os.path.exists(history[2]))
+        self.assertFalse(os.path.exists(self.manifest_file))
+
+    @mock_s3
+    def test_prune(self):
+        client = self._mock_client(['folder/a-1.js', 'folder/a-2.js',
+            'folder/a-2.js.br', 'folder/b-1.js', 'other/a-1.js'])
+        manifests = [{'a.js': 'folder/a-2.js'}, {'b.js': 'folder/b-1.js'}]
+
+        stale_keys, deleted, errors = prune.prune(client, self.bucket,
+            'folder', manifests, dry_run=True)
+        self.assertEqual(stale_keys, ['folder/a-1.js'])
+        self.assertEqual(deleted, 0)
+
+        stale_keys, deleted, errors = prune.prune(client, self.bucket,
+            'folder', manifests)
+        self.assertEqual((deleted, errors), (1, []))
+        self.assertEqual(sorted(list_folder_s3(client, self.bucket, '')),
+            ['folder/a-2.js', 'folder/a-2.js.br', 'folder/b-1.js',
+            'other/a-1.js'])
+
+    @mock_s3
+    def test_find_stale_keys_min_age(self):
+        client = self._mock_client(['folder/a-1.js'])
+        self.assertEqual(list(prune.find_stale_keys(client, self.bucket,
+            'folder', set(), min_age=3600)), [])
+
+        later = datetime.now(timezone.utc) + timedelta(hours=2)
+        self.assertEqual(list(prune.find_stale_keys(client, self.bucket,
+            'folder', set(), min_age=3600, now=later)), ['folder/a-1.js'])
+
+    @mock_s3
+    def test_delete_keys_batches(self):
+        keys = [f'folder/{i}.js' for i in range(5)]
+        client = self._mock_client(keys)
+        calls = []
+        client.meta.events.register('provide-client-params.s3.DeleteObjects',
+            lambda params, **kwargs: calls.append(len(
+                params['Delete']['Objects'])))
+
+        self.assertEqual(delete_keys(client, self.bucket, keys, batch_size=2),
+            (5, []))
+        self.assertEqual(calls, [2, 2, 1])
+        self.assertEqual(list(list_folder_s3(client, self.bucket, 'folder')),
+            [])
+
+    def tearDown(self):
+        for path in [self.manifest_file] + prune.manifest_history(
+                self.manifest_file, 3):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,91 @@
+import json
+import os
+import unittest
+
+from s3_static_sync.rules import FileOptions, Rules, glob_to_regex, load_rules
+
+
+class TestRules(unittest.TestCase):
+    def setUp(self):
+        self.rules_file = 'test_rules.json'
+
+    def _write_rules(self, rules):
+        with open(self.rules_file, 'w') as f:
+            f.write(json.dumps(rules))
+
+    def test_glob_to_regex(self):
+        def matches(pattern, path):
+            return Rules(include=[pattern]).is_included(
+                path.rsplit('/', 1)[-1], path)
+
+        self.assertTrue(matches('*.js', 'a.js'))
+        self.assertTrue(matches('*.js', 'lib/a.js'))
+        self.assertFalse(matches('*.js', 'a.jsx'))
+        self.assertTrue(matches('/index.html', 'index.html'))
+        self.assertFalse(matches('/index.html', 'blog/index.html'))
+        self.assertTrue(matches('assets/*.css', 'assets/a.css'))
+        self.assertFalse(matches('assets/*.css', 'assets/x/a.css'))
+        self.assertTrue(matches('assets/**/*.css', 'assets/x/y/a.css'))
+        self.assertTrue(matches('assets/', 'assets/x/a.png'))
+        self.assertTrue(matches('img/[!_]*.png', 'img/a.png'))
+        self.assertFalse(matches('img/[!_]*.png', 'img/_a.png'))
+        self.assertTrue(matches(r're:\.min\.(js|css)$', 'x/a.min.css'))
+        self.assertEqual(glob_to_regex('a?.txt'), r'^(?:.*/)?a[^/]\.txt\Z')
+
+    def test_filters(self):
+        rules = Rules(include=['*.js', '*.css'], exclude=['vendor/'],
+            ignore_extension=['.min.js'])
+        self.assertTrue(rules.filters)
+        self.assertTrue(rules.is_included('a.js', 'a.js'))
+        self.assertFalse(rules.is_included('a.html', 'a.html'))
+        self.assertFalse(rules.is_included('a.js', 'vendor/a.js'))
+        self.assertFalse(rules.is_included('a.min.js', 'a.min.js'))
+        self.assertFalse(Rules().filters)
+
+    def test_invalid_pattern(self):
+        with self.assertRaises(ValueError):
+            Rules(exclude=['re:(unclosed'])
+
+    def test_options(self):
+        defaults = FileOptions('private', 'max-age=3600', None, True)
+        self._write_rules([
+            {'pattern': '*.html', 'cache_control': 'no-cache'},
+            {'pattern': 'fonts/', 'acl': 'public-read', 'gzip': False},
+            {'pattern': 'fonts/*.svg', 'gzip': True},
+            {'pattern': '*.map', 'exclude': True},
+        ])
+        rules = Rules(rules=load_rules(self.rules_file), defaults=defaults)
+
+        self.assertIs(rules.options('app.js'), defaults)
+        self.assertEqual(rules.options('blog/index.html'),
+            FileOptions('private', 'no-cache', None, True))
+        self.assertEqual(rules.options('fonts/a.woff'),
+            FileOptions('public-read', 'max-age=3600', None, False))
+        self.assertEqual(rules.options('fonts/a.svg'),
+            FileOptions('public-read', 'max-age=3600', None, True))
+        self.assertIs(rules.options('fonts/a.woff'),
+            rules.options('fonts/b.woff'))
+        self.assertFalse(rules.is_included('app.js.map', 'app.js.map'))
+
+    def test_upload_last(self):
+        self._write_rules([{'pattern': 'sitemap.xml', 'upload_last': True}])
+        rules = Rules(rules=load_rules(self.rules_file),
+            upload_last=['*.html'])
+        self.assertTrue(rules.has_last)
+        self.assertTrue(rules.is_last('blog/index.html'))
+        self.assertTrue(rules.is_last('sitemap.xml'))
+        self.assertFalse(rules.is_last('app.js'))
+        self.assertFalse(rules.filters)
+        self.assertFalse(Rules().is_last('index.html'))
+
+    def test_load_rules_errors(self):
+        for rules in ({'pattern': '*'}, [{'acl': 'private'}],
+                [{'pattern': '*', 'headers': {}}],
+                [{'pattern': '*', 'expires_delta': '60'}]):
+            self._write_rules(rules)
+            with self.assertRaises(ValueError):
+                load_rules(self.rules_file)
+
+    def tearDown(self):
+        if os.path.exists(self.rules_file):
+            os.remove(self.rules_file)
@@ -1,10 +1,13 @@
+import gzip
+import io
 import os
 import unittest
 
 from moto import mock_s3
 
-from s3_static_sync.s3 import (check_key_exists, get_client, guess_mime_type,
-    gzip_content, list_folder_s3,
+from s3_static_sync.s3 import (GzipStream, LazyClient, check_key_exists,
+    clear_client_cache, get_client,
+    guess_mime_type, gzip_content, list_folder_s3,
     normalize_folder_name, upload_file)
 
 
@@ -29,6 +32,39 @@ class TestS3Utils(unittest.TestCase):
         self.assertEqual(normalize_folder_name('/folder'), 'folder')
         self.assertEqual(normalize_folder_name('folder'), 'folder')
 
+    def test_get_client_cache(self):
+        client = get_client('us-east-1', max_pool_connections=20, cached=True)
+        self.assertIs(client, get_client('us-east-1', max_pool_connections=20,
+            cached=True))
+        self.assertIsNot(client, get_client('us-east-1',
+            max_pool_connections=30, cached=True))
+        self.assertIsNot(client, get_client('us-east-1',
+            max_pool_connections=20))
+        self.assertEqual(client.meta.config.max_pool_connections, 20)
+        clear_client_cache()
+        self.assertIsNot(client, get_client('us-east-1',
+            max_pool_connections=20, cached=True))
+
+    def test_get_client_options(self):
+        client = get_client('us-east-1', connect_timeout=3, read_timeout=7,
+            tcp_keepalive=True, endpoint_url='http://localhost:9000')
+        self.assertEqual(client.meta.endpoint_url, 'http://localhost:9000')
+        self.assertEqual(client.meta.config.connect_timeout, 3)
+        self.assertEqual(client.meta.config.read_timeout, 7)
+        self.assertTrue(client.meta.config.tcp_keepalive)
+
+    def test_lazy_client(self):
+        created = []
+        client = LazyClient(lambda: get_client('us-east-1'),
+            on_create=created.append)
+        self.assertFalse(client.created)
+        self.assertEqual(created, [])
+
+        self.assertEqual(client.meta.region_name, 'us-east-1')
+        self.assertTrue(client.created)
+        self.assertEqual(created, [client.get()])
+        self.assertIs(client.get(), created[0])
+
     def test_guess_mime_type(self):
         self.assertEqual(guess_mime_type('test.txt'), 'text/plain')
         self.assertEqual(guess_mime_type('test'), 'binary/octet-stream')
@@ -40,6 +76,58 @@ class TestS3Utils(unittest.TestCase):
         self.assertTrue(success)
         self.assertIsNone(err)
 
+    @mock_s3
+    def test_upload_file_content_md5(self):
+        self._mock_client()
+        success, err = upload_file(self.client, self.test_file_name, self.bucket,
+            'folder/test.txt', 'private',
+            content_md5='65a8e27d8879283831b664bd8b7f0ad4')
+        self.assertTrue(success)
+        self.assertIsNone(err)
+
+        success, err = upload_file(self.client, self.test_file_name, self.bucket,
+            'folder/test.txt', 'private', content_md5='not-a-digest')
+        self.assertFalse(success)
+        self.assertIsNotNone(err)
+
+    @mock_s3
+    def test_upload_file_multipart(self):
+        self._mock_client()
+        content = os.urandom(6 * 1024 * 1024)
+        with open('large.bin', 'wb') as f:
+            f.write(content)
+
+        try:
+            for use_gzip in (False, True):
+                success, err = upload_file(self.client, 'large.bin',
+                    self.bucket, 'folder/large.bin', 'private', gzip=use_gzip,
+                    multipart_threshold=5 * 1024 * 1024,
+                    multipart_chunksize=5 * 1024 * 1024)
+                self.assertTrue(success)
+                self.assertIsNone(err)
+
+                response = self.client.get_object(Bucket=self.bucket,
+                    Key='folder/large.bin')
+                self.assertTrue(response['ETag'].endswith('-2"'))
+                body = response['Body'].read()
+                if use_gzip:
+                    self.assertEqual(response['ContentEncoding'], 'gzip')
+                    body = gzip.decompress(body)
+                self.assertEqual(body, content)
+        finally:
+            os.remove('large.bin')
+
+    def test_gzip_stream(self):
+        content = b'Hello, World!' * 1000
+        stream = GzipStream(io.BytesIO(content), chunk_size=7)
+        compressed = b''
+        while True:
+            chunk = stream.read(5)
+            if not chunk:
+                break
+            compressed += chunk
+        self.assertEqual(gzip.decompress(compressed), content)
+
     def test_gzip_content(self):
         original_content = b"Hello, World!"
         gzipped_content = gzip_content(original_content)
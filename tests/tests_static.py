@@ -1,9 +1,15 @@
 import hashlib
 import os
+import shutil
+import time
 import unittest
+from unittest.mock import patch
 
-from s3_static_sync.static import (compose_file_name, get_file_size, get_md5_content,
-    get_timestamp, scan_folder)
+from s3_static_sync.rules import FileOptions, Rules
+from s3_static_sync.static import (SCAN_AHEAD, KeyComposer,
+    _scan_directory, adjust_chunksize, compose_file_name, get_file_size,
+    get_fingerprint, get_md5_content, get_multipart_etag, get_timestamp,
+    scan_entries, scan_folder)
 
 
 class TestFileUtils(unittest.TestCase):
@@ -51,11 +57,74 @@ class TestFileUtils(unittest.TestCase):
         self.assertEqual(len(list(filter(lambda x: x[0].endswith(self.test_file_path),
             file_list))), 0)
 
+    def test_scan_entries(self):
+        # Test that the parallel scanner yields the same entries as os.walk
+        os.makedirs('test_folder/a/b', exist_ok=True)
+        os.makedirs('test_folder/c', exist_ok=True)
+        for file_path in ('a/1.txt', 'a/b/2.txt', 'c/3.txt'):
+            with open(os.path.join('test_folder', file_path), 'w') as f:
+                f.write(file_path)
+        os.symlink(os.path.abspath('test_folder/a'), 'test_folder/link')
+
+        try:
+            walk_list = []
+            for root, dir_list, file_list in os.walk(self.folder_path):
+                walk_list.extend(os.path.join(root, file_name)
+                    for file_name in file_list)
+
+            for workers in (1, 4):
+                entries = list(scan_entries('test_folder', workers=workers))
+                self.assertEqual([entry.path for entry in entries], walk_list)
+                self.assertIn('test_folder/a/b/2.txt',
+                    [entry.manifest_path for entry in entries])
+                for entry in entries:
+                    self.assertEqual(entry.stat.st_size,
+                        os.path.getsize(entry.path))
+        finally:
+            os.remove('test_folder/link')
+            shutil.rmtree('test_folder/a')
+            shutil.rmtree('test_folder/c')
+
+    def test_scan_entries_bounded(self):
+        # A wide tree is not scanned far ahead of the consumer
+        for i in range(50):
+            os.makedirs(f'test_folder/wide/{i:02}')
+            with open(f'test_folder/wide/{i:02}/a.txt', 'w') as f:
+                f.write('a')
+        try:
+            with patch('s3_static_sync.static._scan_directory',
+                    wraps=_scan_directory) as fn:
+                entries = scan_entries('test_folder/wide', workers=2)
+                next(entries)
+                time.sleep(0.05)
+                self.assertLessEqual(fn.call_count, 2 * SCAN_AHEAD + 1)
+                self.assertEqual(len(list(entries)), 49)
+            self.assertEqual(fn.call_count, 51)
+        finally:
+            shutil.rmtree('test_folder/wide')
+
     def test_get_md5_content(self):
         # Test that MD5 hash is correct
         md5_hash = get_md5_content(self.test_file_path)
         self.assertEqual(md5_hash, hashlib.md5(b'Hello, World!').hexdigest())
 
+    def test_get_md5_content_chunked(self):
+        # Test that hashing in several chunks gives the same digest
+        with patch('s3_static_sync.static.CHUNK_SIZE', 4):
+            md5_hash = get_md5_content(self.test_file_path)
+        self.assertEqual(md5_hash, hashlib.md5(b'Hello, World!').hexdigest())
+
+    def test_get_multipart_etag(self):
+        parts = [b'Hello', b', Wor', b'ld!']
+        expected = hashlib.md5(b''.join(hashlib.md5(part).digest()
+            for part in parts)).hexdigest()
+        self.assertEqual(get_multipart_etag(self.test_file_path, 5),
+            f'{expected}-3')
+
+    def test_adjust_chunksize(self):
+        self.assertEqual(adjust_chunksize(100, 10), 10)
+        self.assertEqual(adjust_chunksize(100, 10, max_parts=4), 40)
+
     def test_get_timestamp(self):
         # Test that the timestamp is correct
         timestamp = get_timestamp(self.test_file_path)
@@ -81,6 +150,67 @@ class TestFileUtils(unittest.TestCase):
         )
         self.assertTrue(composed_path.startswith('s3_folder_path'))
 
+    def test_compose_file_name_with_fingerprint(self):
+        # Test that a precomputed fingerprint gives the same composed name
+        params = dict(
+            folder_path=self.folder_path,
+            s3_folder_path='s3_folder_path',
+            file_path=self.test_file_path,
+            header_cache_control=None,
+            header_expires_delta=None,
+            use_gzip=False,
+            use_content=True,
+            use_size=True,
+            use_timestamp=False
+        )
+        fingerprint = get_fingerprint(self.test_file_path, True, True, False,
+            stat_result=os.stat(self.test_file_path))
+        self.assertEqual(fingerprint.size, 13)
+        self.assertIsNone(fingerprint.timestamp)
+
+        with patch('s3_static_sync.static.get_md5_content') as fn:
+            composed_path = compose_file_name(fingerprint=fingerprint, **params)
+            self.assertFalse(fn.called)
+        self.assertEqual(composed_path, compose_file_name(**params))
+
+    def test_key_composer(self):
+        # Same keys as compose_file_name, in subfolders too
+        os.makedirs(os.path.join(self.folder_path, 'sub'))
+        nested_path = os.path.join(self.folder_path, 'sub', 'a.min.js')
+        with open(nested_path, 'w') as f:
+            f.write('js')
+        try:
+            composer = KeyComposer(self.folder_path, 's3', True, True, False)
+            for file_path in (self.test_file_path, nested_path):
+                fingerprint = get_fingerprint(file_path, True, True, False)
+                self.assertEqual(composer.compose(file_path, fingerprint,
+                    FileOptions('private', 'max-age=60', None, True)),
+                    compose_file_name(self.folder_path, 's3', file_path,
+                        'max-age=60', None, True, True, True, False))
+            self.assertTrue(composer.compose(nested_path, fingerprint,
+                FileOptions('private', None, None, False)).startswith(
+                's3/sub/a.min-'))
+
+            # The .br variants are uploaded with the keys that have them
+            options = FileOptions('private', 'max-age=60', None, True)
+            brotli_composer = KeyComposer(self.folder_path, 's3', True, True,
+                False, brotli=True)
+            self.assertNotEqual(brotli_composer.compose(nested_path,
+                fingerprint, options), composer.compose(nested_path,
+                fingerprint, options))
+        finally:
+            os.remove(nested_path)
+            os.rmdir(os.path.dirname(nested_path))
+
+    def test_scan_entries_rules(self):
+        rules = Rules(include=['*.txt'], allow_extension=['.txt', '.jpg'])
+        self.assertEqual([entry.manifest_path for entry in scan_entries(
+            self.folder_path, rules=rules)], ['test_folder/test_file.txt'])
+
+        # A single extension string is one suffix, not a set of characters
+        self.assertEqual(len(list(scan_entries(self.folder_path,
+            allow_extension='.jpg'))), 1)
+
     def tearDown(self):
         # Clean up code, remove test directory and file_list after tests
         os.remove(self.test_file_path)
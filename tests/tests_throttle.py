@@ -0,0 +1,102 @@
+import io
+import os
+import unittest
+from unittest.mock import MagicMock
+
+import botocore.exceptions
+from moto import mock_s3
+
+from s3_static_sync.metrics import Metrics
+from s3_static_sync.s3 import get_client, upload_file
+from s3_static_sync.throttle import (AdaptiveLimiter, RetryPolicy,
+    ThrottledClient, classify_error)
+
+
+def client_error(code, status):
+    return botocore.exceptions.ClientError({
+        'Error': {'Code': code, 'Message': code},
+        'ResponseMetadata': {'HTTPStatusCode': status},
+    }, 'PutObject')
+
+
+class TestThrottle(unittest.TestCase):
+    def test_classify_error(self):
+        self.assertEqual(classify_error(client_error('SlowDown', 503)),
+            (True, True))
+        self.assertEqual(classify_error(client_error('InternalError', 500)),
+            (True, False))
+        self.assertEqual(classify_error(client_error('404', 404)),
+            (False, False))
+        self.assertEqual(classify_error(
+            botocore.exceptions.EndpointConnectionError(endpoint_url='x')),
+            (True, False))
+        self.assertEqual(classify_error(ValueError()), (False, False))
+
+    def test_adaptive_limiter(self):
+        limiter = AdaptiveLimiter(8, cooldown=60)
+        limiter.acquire()
+        limiter.release(throttled=True)
+        self.assertEqual(limiter.limit, 4)
+
+        # Inside the cooldown another throttle does not halve again
+        limiter.acquire()
+        limiter.release(throttled=True)
+        self.assertEqual(limiter.limit, 4)
+
+        for _ in range(4):
+            limiter.acquire()
+            limiter.release()
+        self.assertGreater(limiter.limit, 4.9)
+        self.assertLessEqual(limiter.limit, 8)
+
+    def test_retry_throttled_call(self):
+        client = MagicMock()
+        client.put_object.side_effect = [client_error('SlowDown', 503),
+            client_error('SlowDown', 503), {'ETag': 'x'}]
+        metrics = Metrics()
+        limiter = AdaptiveLimiter(4, cooldown=0)
+        throttled_client = ThrottledClient(client, limiter,
+            RetryPolicy(max_attempts=3, base_delay=0), metrics=metrics)
+
+        body = io.BytesIO(b'content')
+        body.read()
+        self.assertEqual(throttled_client.put_object(Bucket='b', Key='k',
+            Body=body), {'ETag': 'x'})
+        self.assertEqual(client.put_object.call_count, 3)
+        self.assertEqual(body.tell(), 0)
+        self.assertEqual(metrics.counters['retries'], 2)
+        self.assertLess(limiter.limit, 4)
+
+    def test_give_up(self):
+        client = MagicMock()
+        client.put_object.side_effect = client_error('SlowDown', 503)
+        throttled_client = ThrottledClient(client, AdaptiveLimiter(4),
+            RetryPolicy(max_attempts=2, base_delay=0))
+        with self.assertRaises(botocore.exceptions.ClientError):
+            throttled_client.put_object(Bucket='b', Key='k')
+        self.assertEqual(client.put_object.call_count, 2)
+
+        client.head_object.side_effect = client_error('404', 404)
+        with self.assertRaises(botocore.exceptions.ClientError):
+            throttled_client.head_object(Bucket='b', Key='k')
+        self.assertEqual(client.head_object.call_count, 1)
+
+    @mock_s3
+    def test_multipart_through_wrapper(self):
+        client = get_client('us-east-1', max_attempts=1)
+        client.create_bucket(Bucket='test-bucket')
+        metrics = Metrics()
+        metrics.instrument_client(client)
+        throttled_client = ThrottledClient(client, AdaptiveLimiter(4))
+
+        with open('large.bin', 'wb') as f:
+            f.write(os.urandom(6 * 1024 * 1024))
+        try:
+            success, err = upload_file(throttled_client, 'large.bin',
+                'test-bucket', 'large.bin', 'private',
+                multipart_threshold=5 * 1024 * 1024,
+                multipart_chunksize=5 * 1024 * 1024)
+        finally:
+            os.remove('large.bin')
+        self.assertTrue(success, err)
+        self.assertEqual(metrics.report()['requests']['UploadPart']['count'], 2)
@@ -0,0 +1,110 @@
+import os
+import shutil
+import unittest
+
+from s3_static_sync import watch
+from s3_static_sync.rules import Rules
+
+try:
+    import inotify_simple  # noqa: F401
+    HAS_INOTIFY = True
+except ImportError:
+    HAS_INOTIFY = False
+
+
+class FakeWatcher:
+    def __init__(self, polls):
+        self.polls = list(polls)
+        self.timeouts = []
+
+    def poll(self, timeout=None):
+        self.timeouts.append(timeout)
+        return set(self.polls.pop(0)) if self.polls else set()
+
+    def resolve(self, paths):
+        return sorted(paths)
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.folder = os.path.abspath('test_watch_folder')
+        os.makedirs(os.path.join(self.folder, 'css'), exist_ok=True)
+        self._write('index.html', 'index')
+        self._write('css/site.css', 'body {}')
+
+    def _write(self, name, content):
+        with open(os.path.join(self.folder, name), 'w') as f:
+            f.write(content)
+
+    def test_polling_watcher(self):
+        watcher = watch.PollingWatcher(self.folder,
+            Rules(exclude=['*.tmp']), interval=0.01)
+        self.assertEqual(watcher.poll(0.01), set())
+
+        self._write('index.html', 'index v2')
+        self._write('app.js', 'js')
+        self._write('build.tmp', 'tmp')
+        os.remove(os.path.join(self.folder, 'css/site.css'))
+        changed = watcher.poll(0.01)
+        self.assertEqual(changed, {os.path.join(self.folder, name)
+            for name in ('index.html', 'app.js', 'css/site.css')})
+
+        batch = watcher.resolve(changed)
+        self.assertEqual(sorted(entry.manifest_path
+            for entry in batch.entries),
+            ['test_watch_folder/app.js', 'test_watch_folder/index.html'])
+        self.assertEqual(batch.deleted, ['test_watch_folder/css/site.css'])
+
+    def test_watcher_needs_poll(self):
+        with self.assertRaises(TypeError):
+            watch._Watcher(self.folder)
+
+    def test_resolve_new_folder(self):
+        watcher = watch.PollingWatcher(self.folder)
+        os.makedirs(os.path.join(self.folder, 'img/icons'))
+        self._write('img/icons/a.svg', 'svg')
+
+        batch = watcher.resolve({os.path.join(self.folder, 'img')})
+        self.assertEqual([entry.manifest_path for entry in batch.entries],
+            ['test_watch_folder/img/icons/a.svg'])
+
+    @unittest.skipUnless(HAS_INOTIFY, 'inotify_simple is not installed')
+    def test_inotify_watcher(self):
+        watcher = watch.InotifyWatcher(self.folder)
+        try:
+            self._write('css/site.css', 'body { margin: 0 }')
+            os.makedirs(os.path.join(self.folder, 'js'))
+            self._write('js/app.js', 'js')
+            changed = set()
+            while True:
+                more = watcher.poll(0.2)
+                if not more:
+                    break
+                changed |= more
+
+            batch = watcher.resolve(changed)
+            self.assertEqual(sorted(entry.manifest_path
+                for entry in batch.entries),
+                ['test_watch_folder/css/site.css',
+                'test_watch_folder/js/app.js'])
+        finally:
+            watcher.close()
+
+    def test_batches_debounce(self):
+        watcher = FakeWatcher([['a'], ['b'], [], ['c']])
+        batches = watch.batches(watcher, debounce=0.5)
+        self.assertEqual(next(batches), ['a', 'b'])
+        self.assertEqual(watcher.timeouts, [None, 0.5, 0.5])
+
+    def test_drop_deleted(self):
+        manifest = {
+            'site/index.html': 'k1',
+            'site/css/a.css': 'k2',
+            'site/css/b.css': 'k3',
+            'site/cssx/c.css': 'k4',
+        }
+        watch.drop_deleted(manifest, ['site/index.html', 'site/css'])
+        self.assertEqual(manifest, {'site/cssx/c.css': 'k4'})
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)